@@ -0,0 +1,119 @@
+"""
+This module exposes the running service on a Unix domain socket, so the web
+UI can change the whitelist, reload settings or switch the plug without
+restarting the service and re-initializing the PN532 and the Tapo session.
+
+The protocol is JSON-RPC 2.0 with one request or response object per line.
+"""
+
+import asyncio
+import inspect
+import json
+import logging
+import os
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+# Raised by handlers for requests that are valid but cannot be carried out
+APPLICATION_ERROR = -32000
+# The request was based on a version of the data that is no longer current
+VERSION_CONFLICT = -32001
+
+# Longest request line, a whitelist import sends all its UIDs in one request
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+
+
+class ControlError(Exception):
+    """Raised by a handler to answer with an error instead of a result."""
+
+    def __init__(self, message, code=APPLICATION_ERROR, data=None):
+        super().__init__(message)
+        self.code = code
+        self.data = data
+
+
+class ControlServer:
+    """JSON-RPC server on a Unix domain socket. `methods` maps method names
+    to plain or coroutine functions, which are called with the request
+    params as keyword arguments and return a JSON serializable result."""
+
+    def __init__(self, path, methods, mode=0o660, group=None):
+        self.path = path
+        self.methods = methods
+        self.mode = mode
+        self.group = group
+        self._server = None
+
+    async def start(self):
+        # A socket left over from an unclean shutdown would make bind fail
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle_client, path=self.path,
+                                                       limit=MAX_REQUEST_SIZE)
+        os.chmod(self.path, self.mode)
+        if self.group is not None:
+            os.chown(self.path, -1, self.group)
+        logging.info(f'Control socket listening on {self.path}')
+
+    async def close(self):
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self._dispatch(line)
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return _error(None, PARSE_ERROR, 'Parse error')
+        if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+            return _error(None, INVALID_REQUEST, 'Invalid request')
+        request_id = request.get('id')
+        handler = self.methods.get(request['method'])
+        if handler is None:
+            return _error(request_id, METHOD_NOT_FOUND, f"Unknown method {request['method']}")
+        params = request.get('params') or {}
+        if not isinstance(params, dict):
+            return _error(request_id, INVALID_PARAMS, 'Params must be an object')
+        try:
+            inspect.signature(handler).bind(**params)
+        except TypeError as e:
+            return _error(request_id, INVALID_PARAMS, str(e))
+        try:
+            result = handler(**params)
+            if inspect.isawaitable(result):
+                result = await result
+        except ControlError as e:
+            return _error(request_id, e.code, str(e), e.data)
+        except Exception as e:
+            logging.error(f"Control request {request['method']} failed: {e}")
+            return _error(request_id, INTERNAL_ERROR, str(e))
+        return {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+
+
+def _error(request_id, code, message, data=None):
+    error = {'code': code, 'message': message}
+    if data is not None:
+        error['data'] = data
+    return {'jsonrpc': '2.0', 'id': request_id, 'error': error}
@@ -0,0 +1,228 @@
+"""
+This module records every card scan in a local SQLite database, together
+with the decision taken and the outcome of the Tapo call, so usage can be
+reported with indexed queries instead of grepping rotated logs.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import time
+from datetime import datetime
+
+DECISION_MASTER = 'master'
+DECISION_WHITELISTED = 'whitelisted'
+DECISION_UNKNOWN = 'unknown'
+DECISION_ADDED = 'added'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    uid TEXT NOT NULL,
+    decision TEXT NOT NULL,
+    tapo_success INTEGER,
+    tapo_latency REAL
+);
+CREATE INDEX IF NOT EXISTS idx_scans_uid_ts ON scans (uid, ts);
+CREATE INDEX IF NOT EXISTS idx_scans_ts ON scans (ts);
+
+CREATE TABLE IF NOT EXISTS rollup_periods (
+    period TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    decision TEXT NOT NULL,
+    scans INTEGER NOT NULL,
+    tapo_calls INTEGER NOT NULL,
+    tapo_failures INTEGER NOT NULL,
+    latency_sum REAL NOT NULL,
+    latency_max REAL,
+    PRIMARY KEY (period, bucket, decision)
+);
+CREATE TABLE IF NOT EXISTS rollup_users (
+    uid TEXT PRIMARY KEY,
+    scans INTEGER NOT NULL,
+    coffees INTEGER NOT NULL,
+    last_ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_rollup_users_coffees ON rollup_users (coffees);
+"""
+
+# Rollup periods and the strftime format of their bucket labels, in local time
+PERIODS = {
+    'hour': '%Y-%m-%d %H:00',
+    'day': '%Y-%m-%d',
+    'week': '%G-W%V',
+}
+
+_UPSERT_PERIOD = """
+INSERT INTO rollup_periods (period, bucket, decision, scans, tapo_calls, tapo_failures,
+                            latency_sum, latency_max)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (period, bucket, decision) DO UPDATE SET
+    scans = scans + excluded.scans,
+    tapo_calls = tapo_calls + excluded.tapo_calls,
+    tapo_failures = tapo_failures + excluded.tapo_failures,
+    latency_sum = latency_sum + excluded.latency_sum,
+    latency_max = MAX(COALESCE(latency_max, excluded.latency_max),
+                      COALESCE(excluded.latency_max, latency_max))
+"""
+
+_UPSERT_USER = """
+INSERT INTO rollup_users (uid, scans, coffees, last_ts) VALUES (?, ?, ?, ?)
+ON CONFLICT (uid) DO UPDATE SET
+    scans = scans + excluded.scans,
+    coffees = coffees + excluded.coffees,
+    last_ts = MAX(last_ts, excluded.last_ts)
+"""
+
+
+def aggregate(events):
+    """Sum up (ts, uid, decision, tapo_success, tapo_latency) rows into the
+    rows to upsert into rollup_periods and rollup_users."""
+    periods = {}
+    users = {}
+    for ts, uid, decision, tapo_success, tapo_latency in events:
+        local = datetime.fromtimestamp(ts)
+        for period, label in PERIODS.items():
+            key = (period, local.strftime(label), decision)
+            row = periods.get(key)
+            if row is None:
+                row = periods[key] = [0, 0, 0, 0.0, None]
+            row[0] += 1
+            if tapo_success is not None:
+                row[1] += 1
+                row[2] += not tapo_success
+            if tapo_latency is not None:
+                row[3] += tapo_latency
+                row[4] = tapo_latency if row[4] is None else max(row[4], tapo_latency)
+        user = users.get(uid)
+        if user is None:
+            user = users[uid] = [0, 0, ts]
+        user[0] += 1
+        user[1] += decision == DECISION_WHITELISTED
+        user[2] = max(user[2], ts)
+    return ([key + tuple(row) for key, row in periods.items()],
+            [(uid,) + tuple(row) for uid, row in users.items()])
+
+
+class EventStore:
+    """SQLite event store in WAL mode. Events are buffered and inserted in
+    batches of `batch_size`, every `flush_interval` seconds, or on close.
+
+    Each batch also updates the rollup tables in the same transaction:
+    per hour, day and week totals in rollup_periods and per card totals in
+    rollup_users, so reports never have to scan the raw history."""
+
+    def __init__(self, path, batch_size=20, flush_interval=5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._rebuilding = False
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        has_scans = self._conn.execute('SELECT 1 FROM scans LIMIT 1').fetchone()
+        has_rollups = self._conn.execute('SELECT 1 FROM rollup_users LIMIT 1').fetchone()
+        if has_scans and not has_rollups:
+            # Database from before the rollup tables existed
+            self.rebuild_rollups()
+
+    def record_scan(self, uid, decision, tapo_success=None, tapo_latency=None, ts=None):
+        """Queue a scan event. tapo_success and tapo_latency are only set
+        when the scan caused a call to the plug."""
+        if ts is None:
+            ts = time.time()
+        if tapo_success is not None:
+            tapo_success = int(tapo_success)
+        self._pending.append((ts, uid, decision, tapo_success, tapo_latency))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # Events wait in the buffer while a rebuild holds the write lock
+        if not self._pending or self._rebuilding:
+            return
+        periods, users = aggregate(self._pending)
+        with self._conn:
+            self._conn.executemany(
+                'INSERT INTO scans (ts, uid, decision, tapo_success, tapo_latency) '
+                'VALUES (?, ?, ?, ?, ?)', self._pending)
+            self._conn.executemany(_UPSERT_PERIOD, periods)
+            self._conn.executemany(_UPSERT_USER, users)
+        self._pending = []
+
+    def rebuild_rollups(self, chunk_size=10000):
+        """Recompute the rollup tables from the raw scan history. This
+        blocks for as long as it takes to read the history, use
+        rebuild_rollups_async from the event loop."""
+        self.flush()
+        self._rebuild(self._conn, chunk_size)
+
+    async def rebuild_rollups_async(self, chunk_size=10000):
+        """Run the rebuild on a worker thread with its own connection. New
+        events stay buffered until it is done, so they are neither lost
+        nor counted twice."""
+        if self._rebuilding:
+            raise RuntimeError('A rollup rebuild is already running')
+        self.flush()
+        self._rebuilding = True
+        await asyncio.get_running_loop().run_in_executor(None, self._rebuild_in_thread, chunk_size)
+        self.flush()
+
+    def _rebuild_in_thread(self, chunk_size):
+        try:
+            conn = sqlite3.connect(self.path)
+            try:
+                self._rebuild(conn, chunk_size)
+            finally:
+                conn.close()
+        finally:
+            # Also reached if the awaiting task was cancelled at shutdown
+            self._rebuilding = False
+
+    def _rebuild(self, conn, chunk_size):
+        started = time.monotonic()
+        with conn:
+            conn.execute('DELETE FROM rollup_periods')
+            conn.execute('DELETE FROM rollup_users')
+            cursor = conn.execute(
+                'SELECT ts, uid, decision, tapo_success, tapo_latency FROM scans ORDER BY id')
+            while True:
+                events = cursor.fetchmany(chunk_size)
+                if not events:
+                    break
+                periods, users = aggregate(events)
+                conn.executemany(_UPSERT_PERIOD, periods)
+                conn.executemany(_UPSERT_USER, users)
+        logging.info(f'Rebuilt scan rollups in {(time.monotonic() - started) * 1000:.0f} ms')
+
+    async def run_flusher(self):
+        """Insert pending events every `flush_interval` seconds."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logging.error(f"Failed to write scan events: {e}")
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    def count_scans(self, uid, since=None, until=None, decision=None):
+        """Number of scans of `uid` between the `since` and `until` unix
+        timestamps, optionally restricted to one decision."""
+        query = 'SELECT COUNT(*) FROM scans WHERE uid = ? AND ts >= ? AND ts < ?'
+        args = [uid, since or 0, until or float('inf')]
+        if decision is not None:
+            query += ' AND decision = ?'
+            args.append(decision)
+        return self._conn.execute(query, args).fetchone()[0]
+
+    def scan_counts(self):
+        """Lifetime scan count per UID, as kept in card_scans.csv."""
+        self.flush()
+        return dict(self._conn.execute('SELECT uid, COUNT(*) FROM scans GROUP BY uid'))
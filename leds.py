@@ -0,0 +1,112 @@
+"""
+This module drives the Raspberry Pi status LEDs through sysfs without
+blocking the event loop. Flash patterns run as background tasks, and a
+pattern with a higher priority preempts the one playing on the same LED.
+"""
+
+import asyncio
+import logging
+import os
+from collections import namedtuple
+
+LED_BASE_PATH = '/sys/class/leds'
+
+LedPattern = namedtuple('LedPattern', ['led', 'times', 'duration', 'priority'])
+
+PATTERNS = {
+    'heartbeat':    LedPattern('PWR', times=1, duration=0.1, priority=0),
+    'whitelisted':  LedPattern('ACT', times=2, duration=0.1, priority=1),
+    'unknown':      LedPattern('PWR', times=2, duration=0.2, priority=1),
+    'error':        LedPattern('PWR', times=5, duration=0.1, priority=2),
+    'master':       LedPattern('PWR', times=5, duration=0.5, priority=3),
+    'card_added':   LedPattern('PWR', times=10, duration=0.1, priority=3),
+}
+
+# Trigger restored on each LED once a pattern is done
+DEFAULT_TRIGGERS = {
+    'PWR': 'default-on',
+    'ACT': 'mmc0',
+}
+
+
+class Led:
+    """One sysfs LED. The trigger and brightness files are opened once and
+    kept open for the lifetime of the object."""
+
+    def __init__(self, name, base_path=LED_BASE_PATH):
+        self.name = name
+        led_path = os.path.join(base_path, name)
+        self._trigger = os.open(os.path.join(led_path, 'trigger'), os.O_WRONLY)
+        self._brightness = os.open(os.path.join(led_path, 'brightness'), os.O_WRONLY)
+
+    def _write(self, fd, value):
+        os.pwrite(fd, value.encode(), 0)
+
+    def set_trigger(self, trigger):
+        self._write(self._trigger, trigger)
+
+    def set(self, on):
+        self._write(self._brightness, '1' if on else '0')
+
+    def close(self):
+        os.close(self._trigger)
+        os.close(self._brightness)
+
+
+class LedSignaller:
+    """Plays named patterns from PATTERNS as asyncio tasks, one per LED."""
+
+    def __init__(self, base_path=LED_BASE_PATH):
+        self._base_path = base_path
+        self._leds = {}
+        self._playing = {}
+
+    def _led(self, name):
+        if name not in self._leds:
+            try:
+                self._leds[name] = Led(name, self._base_path)
+            except OSError:
+                logging.error(f"LED paths for {name} do not exist, cannot flash LED.")
+                self._leds[name] = None
+        return self._leds[name]
+
+    def play(self, name):
+        """Start the named pattern unless a higher priority pattern is
+        playing on the same LED. Returns immediately."""
+        pattern = PATTERNS[name]
+        led = self._led(pattern.led)
+        if led is None:
+            return
+        current = self._playing.get(pattern.led)
+        if current is not None and not current[1].done():
+            if current[0].priority > pattern.priority:
+                return
+            current[1].cancel()
+        task = asyncio.create_task(self._run(led, pattern))
+        self._playing[pattern.led] = (pattern, task)
+
+    async def _run(self, led, pattern):
+        try:
+            led.set_trigger('none')
+            for _ in range(pattern.times):
+                led.set(True)
+                await asyncio.sleep(pattern.duration)
+                led.set(False)
+                await asyncio.sleep(pattern.duration)
+        except OSError as e:
+            logging.error(f"Failed to flash LED {led.name}: {e}")
+        finally:
+            # A preempting pattern owns the LED from here on
+            if self._playing[led.name][1] is asyncio.current_task():
+                try:
+                    led.set(False)
+                    led.set_trigger(DEFAULT_TRIGGERS.get(led.name, 'none'))
+                except OSError:
+                    pass
+
+    def close(self):
+        for _, task in self._playing.values():
+            task.cancel()
+        for led in self._leds.values():
+            if led is not None:
+                led.close()
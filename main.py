@@ -1,13 +1,25 @@
+import time
+
+# Reference point for the startup timing report, taken before the imports
+process_start = time.monotonic()
+
 import asyncio
+import grp
 import os
 import configparser
 from datetime import datetime
-from tapo import ApiClient
-from pn532 import PN532_SPI
-import time
+from pn532 import PN532_SPI, TIMING_CONSERVATIVE, TIMING_FAST, calibrate_timing
 import logging
 from logging.handlers import RotatingFileHandler
-import csv
+import signal
+from control_server import ControlServer, ControlError, INVALID_PARAMS, VERSION_CONFLICT
+from leds import LedSignaller
+from event_store import (EventStore, DECISION_MASTER, DECISION_WHITELISTED,
+                         DECISION_UNKNOWN, DECISION_ADDED)
+from nfc_reader import AsyncCardReader, CARD_LEFT, MODE_PASSIVE, configure_bounded_polling
+from scan_counts import ScanCounter
+from tapo_session import TapoSession, FakeApiClient, PlugController
+from whitelist import Whitelist, VersionConflict
 
 # Read configuration from tapo.ini
 config = configparser.ConfigParser()
@@ -18,146 +30,264 @@ if not os.path.exists(config_file):
 
 config.read(config_file)
 
+log_file = 'card_scans.log'
+
+# Set up logging with rotation. This comes first, any earlier logging call
+# would install a default handler and turn basicConfig into a no-op.
+log_handler = RotatingFileHandler(log_file, maxBytes=10*1024*1024, backupCount=5)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(message)s',
+    handlers=[
+        log_handler,
+        logging.StreamHandler()
+    ]
+)
+
+def parse_master_uids(value):
+    uids = set()
+    for uid in (uid.strip() for uid in value.split(',')):
+        if not uid:
+            continue
+        try:
+            uids.add(bytes.fromhex(uid))
+        except ValueError:
+            logging.error(f"Ignoring invalid master card UID: {uid!r}")
+    return frozenset(uids)
+
 tapo_username = config['DEFAULT']['TAPO_USERNAME']
 tapo_password = config['DEFAULT']['TAPO_PASSWORD']
 ip_address = config['DEFAULT']['IP_ADDRESS']
 on_time = int(config['DEFAULT']['ON_TIME'])
-master_card_uids = config['DEFAULT']['MASTER_CARD_UIDS'].split(',')
+master_card_uids = parse_master_uids(config['DEFAULT']['MASTER_CARD_UIDS'])
+fake_plug = config['DEFAULT'].getboolean('FAKE_PLUG', fallback=False)
+irq_pin = config['DEFAULT'].getint('PN532_IRQ', fallback=None)
+reader_mode = config['DEFAULT'].get('READER_MODE', fallback=MODE_PASSIVE)
+passive_retries = config['DEFAULT'].getint('PASSIVE_RETRIES', fallback=None)
+# conservative, fast or calibrate
+timing_profile = config['DEFAULT'].get('TIMING_PROFILE', fallback='conservative')
+fast_start = config['DEFAULT'].getboolean('FAST_START', fallback=False)
+# Seconds a card may go unseen and still count as the same tap
+debounce = config['DEFAULT'].getfloat('DEBOUNCE', fallback=1.0)
+# Seconds without a card before the PN532 is powered down between polls
+idle_after = config['DEFAULT'].getfloat('IDLE_AFTER', fallback=None)
+idle_interval = config['DEFAULT'].getfloat('IDLE_INTERVAL', fallback=2.0)
+# Unix socket for the web UI, see control_server.py
+control_socket = config['DEFAULT'].get('CONTROL_SOCKET', fallback='control.sock')
+control_socket_group = config['DEFAULT'].get('CONTROL_SOCKET_GROUP', fallback=None)
+
+# Seconds between heartbeat flashes, and while the reader is idle
+HEARTBEAT_INTERVAL = 5
+IDLE_HEARTBEAT_INTERVAL = 60
+
+# Long-lived Tapo session, logs in once and is reused for every tap
+plug_session = TapoSession(tapo_username, tapo_password, ip_address,
+                           client_factory=FakeApiClient if fake_plug else None)
 
 # Whitelist file
 whitelist_file = 'whitelist.txt'
-log_file = 'card_scans.log'
 csv_file = 'card_scans.csv'
+db_file = 'card_scans.db'
 
-# Function to load whitelist
-def load_whitelist():
-    if not os.path.exists(whitelist_file):
-        return set()
-    with open(whitelist_file, 'r') as f:
-        return set(line.strip() for line in f)
+# Initialize whitelist, reloaded automatically when the file changes
+whitelist = Whitelist(whitelist_file, master_uids=master_card_uids)
 
-# Function to save whitelist
-def save_whitelist(whitelist):
-    with open(whitelist_file, 'w') as f:
-        for uid in whitelist:
-            f.write(f"{uid}\n")
+# Status LEDs, patterns play in the background
+leds = LedSignaller()
 
-# Initialize whitelist
-whitelist = load_whitelist()
+# Every scan is recorded with its decision and plug outcome
+event_store = EventStore(db_file)
 
-# Set up logging with rotation
-log_handler = RotatingFileHandler(log_file, maxBytes=10*1024*1024, backupCount=5)
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s %(message)s',
-    handlers=[
-        log_handler,
-        logging.StreamHandler()
-    ]
-)
+# Scan counts are kept in memory and flushed to the CSV file in batches
+scan_counter = ScanCounter(csv_file)
+if not scan_counter.counts:
+    # Rebuild a missing CSV from the recorded scan history
+    scan_counter.counts = event_store.scan_counts()
 
 # Function to update CSV file with scan counts
 def update_csv(uid):
-    if not os.path.exists(csv_file):
-        with open(csv_file, mode='w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(['UID', 'Count'])
-    
-    rows = []
-    found = False
-    with open(csv_file, mode='r', newline='') as file:
-        reader = csv.reader(file)
-        for row in reader:
-            if row[0] == uid:
-                row[1] = str(int(row[1]) + 1)
-                found = True
-            rows.append(row)
-    
-    if not found:
-        rows.append([uid, '1'])
-    
-    with open(csv_file, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerows(rows)
+    scan_counter.increment(uid)
 
 async def control_tapo(turn_on=True):
     try:
-        client = ApiClient(tapo_username, tapo_password)
-        device = await asyncio.wait_for(client.p110(ip_address), timeout=3)
         if turn_on:
             logging.info("Turning device on...")
-            await device.on()
-            return True
         else:
             logging.info("Turning device off...")
-            await device.off()
-            return True
+        return await plug_session.set_power(turn_on)
     except (asyncio.TimeoutError, Exception) as e:
         logging.error(f"Failed to connect to the Tapo device: {e}")
-        flash_led('PWR', times=5, duration=0.1)
+        leds.play('error')
         return False
 
 def setup_nfc():
-    pn532 = PN532_SPI(debug=False, reset=20, cs=4)
-    ic, ver, rev, support = pn532.get_firmware_version()
+    timing = TIMING_FAST if timing_profile == 'fast' else TIMING_CONSERVATIVE
+    pn532 = PN532_SPI(debug=False, reset=20, cs=4, irq=irq_pin, timing=timing,
+                      fast_start=fast_start)
+    if timing_profile == 'calibrate':
+        timing = calibrate_timing(pn532)
+        logging.info(f'Calibrated PN532 timing: {timing}')
+    ic, ver, rev, support = pn532.firmware_version or pn532.get_firmware_version()
     logging.info(f'Found PN532 with firmware version: {ver}.{rev}')
 
     # Configure PN532 to communicate with MiFare cards
     pn532.SAM_configuration()
+    if passive_retries is not None:
+        # Let the firmware answer "no card" quickly instead of the host timing out
+        configure_bounded_polling(pn532, passive_retries)
 
     return pn532
 
-def flash_led(led, times=3, duration=0.2):
-    led_trigger_path = f'/sys/class/leds/{led}/trigger'
-    led_brightness_path = f'/sys/class/leds/{led}/brightness'
-
-    if not os.path.exists(led_trigger_path) or not os.path.exists(led_brightness_path):
-        logging.error(f"LED paths for {led} do not exist, cannot flash LED.")
-        return
-
-    # Set LED control to none
-    with open(led_trigger_path, 'w') as f:
-        f.write('none')
-
-    # Flash the LED
-    for _ in range(times):
-        with open(led_brightness_path, 'w') as f:
-            f.write('1')  # Turn on the LED
-        time.sleep(duration)
-        with open(led_brightness_path, 'w') as f:
-            f.write('0')  # Turn off the LED
-        time.sleep(duration)
-    
-    # Set LED control back to default
-    with open(led_trigger_path, 'w') as f:
-        f.write('default-on' if led == 'PWR' else 'mmc0')
+# Pick the card to act on when several are on the reader at once
+def choose_target(uids):
+    decisions = [whitelist.decide(uid) for uid in uids]
+    for preferred in (DECISION_WHITELISTED, DECISION_MASTER):
+        if preferred in decisions:
+            return uids[decisions.index(preferred)]
+    return uids[0]
+
+# Turn a hex UID sent over the control socket into bytes
+def parse_control_uid(uid):
+    try:
+        uid_bytes = bytes.fromhex(uid)
+    except (TypeError, ValueError):
+        uid_bytes = b''
+    if not uid_bytes:
+        raise ControlError(f'Invalid UID: {uid!r}', INVALID_PARAMS)
+    return uid_bytes
+
+async def start_tapo():
+    # Log in once and try to turn off the plug initially
+    started = time.monotonic()
+    await plug_session.start()
+    try:
+        await control_tapo(turn_on=False)
+    except Exception as e:
+        logging.error(f"Failed to connect to the Tapo device initially: {e}")
+    logging.info(f'Startup: Tapo ready after {(time.monotonic() - started) * 1000:.0f} ms')
 
 async def main():
-    pn532 = setup_nfc()
+    # Let systemd stop the service cleanly so pending scan counts get flushed
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    asyncio.create_task(scan_counter.run_flusher())
+    asyncio.create_task(event_store.run_flusher())
+    asyncio.create_task(whitelist.watch())
+
+    # Log in to the plug and turn it off while the reader is brought up
+    tapo_task = asyncio.create_task(start_tapo())
+
+    main_start = time.monotonic()
+    pn532 = await asyncio.get_running_loop().run_in_executor(None, setup_nfc)
+    reader_ready = time.monotonic()
+    # Poll the reader on its own thread so the event loop is never blocked
+    reader = AsyncCardReader(pn532, poll_timeout=0.5, mode=reader_mode, debounce=debounce,
+                             poll_interval=0.1 if passive_retries is not None else 0,
+                             max_targets=2, choose_target=choose_target,
+                             idle_after=idle_after, idle_interval=idle_interval)
+    reader.start()
+    logging.info(f'Startup: imports and config {(main_start - process_start) * 1000:.0f} ms, '
+                 f'PN532 bring-up {(reader_ready - main_start) * 1000:.0f} ms, '
+                 f'polling after {(time.monotonic() - process_start) * 1000:.0f} ms')
     logging.info('Waiting for RFID/NFC card...')
     
     master_mode = False
     master_mode_start = None
     master_mode_event = asyncio.Event()
+    async def switch_plug(turn_on):
+        # The startup "off" must land before the first window switches on
+        await asyncio.wait([tapo_task])
+        return await control_tapo(turn_on)
 
-    # Try to turn off the plug initially
+    plug_controller = PlugController(switch_plug, on_time)
+
+    # Admin requests from the web UI, answered without restarting the service
+    def change_whitelist(add=(), remove=(), replace=None, expected_versions=None):
+        add = [parse_control_uid(uid) for uid in add]
+        remove = [parse_control_uid(uid) for uid in remove]
+        if replace is not None:
+            replace = [parse_control_uid(uid) for uid in replace]
+        try:
+            version = whitelist.change(add, remove, replace, expected_versions)
+        except VersionConflict as e:
+            raise ControlError('Whitelist was changed by someone else', VERSION_CONFLICT,
+                               data={'version': e.version})
+        if replace is not None:
+            logging.info(f'Whitelist replaced with {len(replace)} cards over the control socket.')
+        else:
+            logging.info(f'Whitelist changed over the control socket: {len(add)} added, '
+                         f'{len(remove)} removed.')
+        return {'version': version}
+
+    def reload_config():
+        # Only settings that can change without touching the reader or plug
+        fresh = configparser.ConfigParser()
+        if not fresh.read(config_file):
+            raise ControlError(f'Cannot read {config_file}')
+        settings = fresh['DEFAULT']
+        # Parse everything before applying anything, so a bad value leaves
+        # the running configuration untouched instead of half reloaded
+        try:
+            new_on_time = int(settings['ON_TIME'])
+            new_master_uids = parse_master_uids(settings['MASTER_CARD_UIDS'])
+            new_debounce = settings.getfloat('DEBOUNCE', fallback=1.0)
+        except (KeyError, ValueError) as e:
+            raise ControlError(f'Invalid configuration, nothing changed: {e!r}')
+        plug_controller.on_time = new_on_time
+        whitelist.set_master_uids(new_master_uids)
+        reader.debounce = new_debounce
+        whitelist.check()
+        logging.info('Configuration reloaded over the control socket.')
+        return {'on_time': plug_controller.on_time, 'master_cards': len(whitelist.master_uids),
+                'debounce': reader.debounce}
+
+    def state():
+        return {'master_mode': master_mode, 'plug_on': plug_controller.is_active,
+                'on_time': plug_controller.on_time, 'whitelist_size': len(whitelist),
+                'whitelist_reloads': whitelist.reload_count, 'reader_idle': reader.idle,
+                'power_times': reader.power_times(),
+                'uptime': time.monotonic() - process_start}
+
+    def trigger_plug():
+        logging.info('Plug triggered over the control socket.')
+        return {'extended': plug_controller.activate()}
+
+    def counters():
+        return {'scans': scan_counter.counts}
+
+    control = ControlServer(control_socket, {
+        'change_whitelist': change_whitelist,
+        'reload_config': reload_config,
+        'state': state,
+        'trigger_plug': trigger_plug,
+        'counters': counters,
+        'rebuild_rollups': event_store.rebuild_rollups_async,
+    }, group=grp.getgrnam(control_socket_group).gr_gid if control_socket_group else None)
     try:
-        await control_tapo(turn_on=False)
-    except Exception as e:
-        logging.error(f"Failed to connect to the Tapo device initially: {e}")
+        await control.start()
+    except OSError as e:
+        logging.error(f"Failed to open control socket {control_socket}: {e}")
 
-    loop_counter = 0
+    next_heartbeat = time.monotonic()
 
     while True:
         try:
-            # Check if a card is available to read
-            uid = pn532.read_passive_target(timeout=0.5)
+            # Sleep until the next card, heartbeat or master mode timeout
+            timeout = max(0, next_heartbeat - time.monotonic())
+            if master_mode:
+                timeout = min(timeout, 0.5)
+            # Check if a card arrived or left
+            event = await reader.read_event(timeout=timeout)
+            if event is not None and event.kind == CARD_LEFT:
+                logging.info(f'Card {event.uid.hex()} removed.')
+                continue
+            uid = event and event.uid
     
-            # Increment loop counter and flash PWR LED every 10 loops
-            loop_counter += 1
-            if loop_counter >= 10:
-                flash_led('PWR', times=1, duration=0.1)
-                loop_counter = 0
+            # Flash PWR LED now and then, less often while the reader is idle
+            now = time.monotonic()
+            if now >= next_heartbeat:
+                leds.play('heartbeat')
+                next_heartbeat = now + (IDLE_HEARTBEAT_INTERVAL if reader.idle
+                                        else HEARTBEAT_INTERVAL)
     
             # Try again if no card is available.
             if uid is None:
@@ -168,38 +298,42 @@ async def main():
                     logging.info('Master mode timed out.')
                 continue
     
-            uid_hex = ''.join([hex(i)[2:].zfill(2) for i in uid])
+            # UIDs stay bytes for the lookup, hex is only for logs and storage
+            decision = whitelist.decide(uid)
+            uid_hex = uid.hex()
             logging.info(f'Found card with UID: {uid_hex}')
             update_csv(uid_hex)
     
             if master_mode:
                 logging.info('Adding new card to whitelist...')
-                whitelist.add(uid_hex)
-                save_whitelist(whitelist)
-                flash_led('PWR', times=10, duration=0.1)
+                whitelist.add(uid)
+                event_store.record_scan(uid_hex, DECISION_ADDED)
+                leds.play('card_added')
                 master_mode = False
                 logging.info('New card added successfully!')
-            elif uid_hex in master_card_uids:
+            elif decision == DECISION_MASTER:
                 logging.info('Master card detected. Entering master mode...')
                 master_mode = True
-                flash_led('PWR', times=5, duration=0.5)
+                event_store.record_scan(uid_hex, DECISION_MASTER)
+                leds.play('master')
                 master_mode_start = datetime.now()
-            elif uid_hex in whitelist:
+            elif decision == DECISION_WHITELISTED:
                 logging.info('Whitelisted card detected. Controlling Tapo device...')
-                flash_led('ACT', times=2, duration=0.1)
-                try:
-                    success = await control_tapo()
-                    if success:
-                        await asyncio.sleep(on_time)
-                        await control_tapo(turn_on=False)
-                except Exception as e:
-                    logging.error(f"Failed to control the Tapo device: {e}")
+                leds.play('whitelisted')
+                # The on-time window runs in the background so polling continues
+                scanned_at = time.time()
+                def record_activation(success, latency, uid_hex=uid_hex, scanned_at=scanned_at):
+                    event_store.record_scan(uid_hex, DECISION_WHITELISTED, success, latency, ts=scanned_at)
+                if plug_controller.activate(on_result=record_activation):
+                    logging.info('Tapo device already on, extending on time.')
+                    event_store.record_scan(uid_hex, DECISION_WHITELISTED, ts=scanned_at)
             else:
                 logging.info('Card not recognized.')
-                flash_led('PWR', times=2, duration=0.2)
+                event_store.record_scan(uid_hex, DECISION_UNKNOWN)
+                leds.play('unknown')
         except Exception as e:
             logging.error(f"Exception in main loop: {e}")
-            flash_led('PWR', times=5, duration=0.1)
+            leds.play('error')
             await asyncio.sleep(1)  # Add a small delay before continuing
 
 if __name__ == "__main__":
@@ -208,4 +342,7 @@ if __name__ == "__main__":
     except Exception as e:
         logging.error(e)
     finally:
+        scan_counter.flush()
+        event_store.close()
+        leds.close()
         GPIO.cleanup()
@@ -0,0 +1,262 @@
+"""
+This module wraps the blocking PN532 driver so it can be used from asyncio.
+Polling runs on a dedicated reader thread and card arrivals and departures
+are handed to the event loop through a bounded queue.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from collections import namedtuple
+
+
+MODE_PASSIVE = 'passive'
+MODE_AUTOPOLL = 'autopoll'
+
+POWER_ACTIVE = 'active'
+POWER_DOWN = 'powerdown'
+
+# First wait between polls once idle, doubled after every empty poll
+_IDLE_RAMP_START = 0.2
+
+# Never give up on ATR, one PSL retry, firmware default otherwise
+_MAX_RETRIES_ATR = 0xFF
+_MAX_RETRIES_PSL = 0x01
+
+
+CARD_ARRIVED = 'arrived'
+CARD_LEFT = 'left'
+
+CardEvent = namedtuple('CardEvent', ['kind', 'uid'])
+
+
+class PresenceTracker:
+    """Turns poll results into card-arrived and card-left events. A card
+    stays present as long as it is seen again within `debounce` seconds, so
+    one physical tap gives one arrival however long the card is held."""
+
+    def __init__(self, debounce=1.0):
+        self.debounce = debounce
+        self.present = None
+        self._last_seen = 0.0
+
+    def update(self, uid, now=None):
+        """Feed one poll result, None if no card was found. Returns the list
+        of CardEvent it caused."""
+        if now is None:
+            now = time.monotonic()
+        events = []
+        if self.present is not None and uid != self.present:
+            # Another card replaced it, or it has not been seen for too long
+            if uid is not None or now - self._last_seen >= self.debounce:
+                events.append(CardEvent(CARD_LEFT, self.present))
+                self.present = None
+        if uid is not None:
+            if self.present is None:
+                events.append(CardEvent(CARD_ARRIVED, uid))
+                self.present = uid
+            self._last_seen = now
+        return events
+
+
+def configure_bounded_polling(pn532, passive_retries=2):
+    """Limit the passive activation retries of the PN532, so every
+    InListPassiveTarget ends with a definite "no card" from the firmware
+    after a few milliseconds instead of being abandoned by the host."""
+    pn532.rf_configure(max_retries=(_MAX_RETRIES_ATR, _MAX_RETRIES_PSL, passive_retries))
+
+
+class AsyncCardReader:
+    """Asyncio facade around a PN532 instance. The reader thread applies
+    backpressure when the queue is full, and a PresenceTracker reduces the
+    repeated reads of a card that stays on the reader to one arrival. Each
+    arrival is followed by InRelease, so the PN532 does not keep the
+    target active between polls.
+
+    In MODE_PASSIVE the host drives every detection cycle with
+    InListPassiveTarget. In MODE_AUTOPOLL the PN532 cycles through the card
+    types by itself via InAutoPoll and the host only waits for a result.
+    With an IRQ pin the only bus traffic while idle is renewing the
+    InAutoPoll command every `autopoll_timeout` seconds.
+
+    In MODE_PASSIVE with `idle_after` set, the reader goes idle once no card
+    has been seen for that many seconds: the PN532 is put into PowerDown
+    between polls, and the wait between polls doubles up to
+    `idle_interval`. The first card found brings it back to full rate."""
+
+    def __init__(self, pn532, poll_timeout=0.5, queue_size=4, debounce=1.0,
+                 mode=MODE_PASSIVE, autopoll_timeout=5, poll_interval=0,
+                 max_targets=1, choose_target=None, idle_after=None, idle_interval=2.0):
+        self._pn532 = pn532
+        self._max_targets = max_targets
+        # Picks one UID when several cards are on the reader at once
+        self._choose_target = choose_target or (lambda uids: uids[0])
+        self._poll_timeout = poll_timeout
+        self._poll_interval = poll_interval
+        self._mode = mode
+        self._autopoll_timeout = autopoll_timeout
+        self._queue_size = queue_size
+        self._tracker = PresenceTracker(debounce)
+        self._idle_after = idle_after if mode == MODE_PASSIVE else None
+        self._idle_interval = idle_interval
+        self._idle_wait = 0
+        self._idle_since = None
+        self._last_activity = time.monotonic()
+        self._power_state = POWER_ACTIVE
+        self._power_since = time.monotonic()
+        self._power_times = dict.fromkeys((POWER_ACTIVE, POWER_DOWN), 0.0)
+        self._queue = None
+        self._loop = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Start the reader thread. Must be called from the event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='pn532-reader', daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        """Stop the reader thread and wait for the current poll to finish."""
+        self._stop.set()
+        if self._thread is not None:
+            await self._loop.run_in_executor(None, self._thread.join)
+            self._thread = None
+
+    async def read_event(self, timeout=None):
+        """Wait up to timeout seconds for the next CardEvent. Returns None on
+        timeout and re-raises errors from the reader."""
+        try:
+            item = await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    async def read(self, timeout=None):
+        """Wait up to timeout seconds for the next card to arrive. Returns
+        the UID as bytes, None on timeout, and re-raises errors from the
+        reader. Departures are skipped."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            event = await self.read_event(remaining)
+            if event is None or event.kind == CARD_ARRIVED:
+                return event and event.uid
+
+    @property
+    def debounce(self):
+        return self._tracker.debounce
+
+    @debounce.setter
+    def debounce(self, seconds):
+        self._tracker.debounce = seconds
+
+    @property
+    def idle(self):
+        """True while polling at the reduced idle rate."""
+        return self._idle_wait > 0
+
+    def power_times(self):
+        """Seconds the PN532 spent in each power state since the reader was
+        created, keyed by POWER_ACTIVE and POWER_DOWN."""
+        times = dict(self._power_times)
+        times[self._power_state] += time.monotonic() - self._power_since
+        return times
+
+    def _set_power_state(self, state):
+        now = time.monotonic()
+        self._power_times[self._power_state] += now - self._power_since
+        self._power_state = state
+        self._power_since = now
+
+    def _sleep(self):
+        # Wait between two idle polls with the PN532 powered down
+        self._idle_wait = min(self._idle_interval,
+                              max(self._idle_wait * 2, _IDLE_RAMP_START))
+        try:
+            powered_down = self._pn532.power_down()
+        except Exception as e:
+            logging.debug(f'PowerDown failed: {e}')
+            powered_down = False
+        if not powered_down:
+            self._stop.wait(self._idle_wait)
+            return
+        self._set_power_state(POWER_DOWN)
+        self._stop.wait(self._idle_wait)
+        try:
+            self._pn532.wake_up()
+        finally:
+            self._set_power_state(POWER_ACTIVE)
+
+    def _leave_idle(self):
+        self._idle_wait = 0
+        times = self.power_times()
+        share = times[POWER_DOWN] / (sum(times.values()) or 1)
+        logging.info(f'Card found, leaving idle mode after '
+                     f'{time.monotonic() - self._idle_since:.0f} s. PN532 powered '
+                     f'down {share:.0%} of the time since start.')
+
+    def _release(self):
+        try:
+            self._pn532.in_release()
+        except Exception as e:
+            logging.debug(f'InRelease failed: {e}')
+
+    def _deliver(self, item):
+        # Blocks the reader thread while the queue is full
+        future = asyncio.run_coroutine_threadsafe(self._queue.put(item), self._loop)
+        while not self._stop.is_set():
+            try:
+                future.result(timeout=self._poll_timeout)
+                return
+            except concurrent.futures.TimeoutError:
+                continue
+        future.cancel()
+
+    def _poll(self):
+        if self._mode == MODE_AUTOPOLL:
+            targets = self._pn532.auto_poll(timeout=self._autopoll_timeout)
+        elif self._max_targets > 1:
+            targets = self._pn532.read_passive_targets(self._max_targets, timeout=self._poll_timeout)
+        else:
+            return self._pn532.read_passive_target(timeout=self._poll_timeout)
+        uids = [target.uid for target in targets or () if target.uid]
+        if not uids:
+            return None
+        return uids[0] if len(uids) == 1 else self._choose_target(uids)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                uid = self._poll()
+            except Exception as e:
+                self._deliver(e)
+                self._stop.wait(1)
+                continue
+            if uid is not None:
+                uid = bytes(uid)
+                self._last_activity = time.monotonic()
+                if self._idle_wait:
+                    self._leave_idle()
+            events = self._tracker.update(uid)
+            for event in events:
+                self._deliver(event)
+            if events and events[-1].kind == CARD_ARRIVED:
+                self._release()
+            if uid is not None or self._stop.is_set():
+                continue
+            if (self._idle_after is not None
+                    and time.monotonic() - self._last_activity >= self._idle_after):
+                if not self._idle_wait:
+                    logging.info('No card for a while, entering idle mode.')
+                    self._idle_since = time.monotonic()
+                self._sleep()
+            elif self._poll_interval:
+                self._stop.wait(self._poll_interval)
+        logging.info('Reader thread stopped.')
@@ -5,9 +5,15 @@ __all__ = [
     'uart',
     'PN532_I2C',
     'PN532_SPI',
-    'PN532_UART'
+    'PN532_UART',
+    'TimingProfile',
+    'TIMING_CONSERVATIVE',
+    'TIMING_FAST',
+    'calibrate_timing',
+    'parse_tlvs'
 ]
 from . import pn532
+from .pn532 import TimingProfile, TIMING_CONSERVATIVE, TIMING_FAST, calibrate_timing, parse_tlvs
 from .i2c import PN532_I2C
 from .spi import PN532_SPI
 from .uart import PN532_UART
@@ -33,7 +33,7 @@ import fcntl
 import os
 import time
 import RPi.GPIO as GPIO
-from .pn532 import PN532, BusyError
+from .pn532 import PN532, BusyError, TIMING_CONSERVATIVE, WAKE_I2C
 
 # pylint: disable=bad-whitespace
 # PN532 address without R/W bit, i.e. (0x48 >> 1)
@@ -65,12 +65,19 @@ class I2CDevice:
 
 class PN532_I2C(PN532):
     """Driver for the PN532 connected over I2C."""
-    def __init__(self, irq=None, reset=None, req=None, debug=False):
+
+    _WAKE_HOST = WAKE_I2C
+
+    def __init__(self, irq=None, reset=None, req=None, debug=False, timing=TIMING_CONSERVATIVE,
+                 fast_start=False):
         """Create an instance of the PN532 class using I2C. Note that PN532
-        uses clock stretching. Optional IRQ pin (not used),
-        reset pin and debugging output.
+        uses clock stretching. Optional IRQ pin (waits on its falling edge
+        instead of polling the status byte), reset pin and debugging output.
+        `timing` is the TimingProfile for the delays on the bus. With
+        `fast_start` the reset and wakeup are skipped if the PN532 answers.
         """
         self.debug = debug
+        self.timing = timing
         self._irq = irq
         self._req = req
         GPIO.setmode(GPIO.BCM)
@@ -82,7 +89,7 @@ class PN532_I2C(PN532):
         GPIO.setup(req, GPIO.OUT)
         self._gpio_init(irq=irq, req=req, reset=reset)
         self._i2c = I2CDevice(I2C_CHANNEL, I2C_ADDRESS)
-        super().__init__(debug=debug, reset=reset)
+        super().__init__(debug=debug, reset=reset, fast_start=fast_start)
 
     def _gpio_init(self, reset, irq=None, req=None):
         self._irq = irq
@@ -96,29 +103,42 @@ class PN532_I2C(PN532):
         if req:
             GPIO.setup(req, GPIO.OUT)
             GPIO.output(req, True)
+        self._irq_init()
 
     def _reset(self, pin):
         """Perform a hardware reset toggle"""
         GPIO.output(pin, True)
-        time.sleep(0.1)
+        time.sleep(self.timing.reset_high)
         GPIO.output(pin, False)
-        time.sleep(0.5)
+        time.sleep(self.timing.reset_low)
         GPIO.output(pin, True)
-        time.sleep(0.1)
+        time.sleep(self.timing.reset_high)
 
     def _wakeup(self): # pylint: disable=no-self-use
         """Send any special commands/data to wake up PN532"""
         if self._req:
             GPIO.output(self._req, True)
-            time.sleep(0.1)
+            time.sleep(self.timing.req_pulse)
+            GPIO.output(self._req, False)
+            time.sleep(self.timing.req_pulse)
+            GPIO.output(self._req, True)
+        time.sleep(self.timing.i2c_wakeup_delay)
+
+    def _wake_from_powerdown(self):
+        """Wake up from PowerDown with a short H_Request pulse if wired,
+        otherwise the next I2C access wakes the chip."""
+        if self._req:
             GPIO.output(self._req, False)
-            time.sleep(0.1)
+            time.sleep(self.timing.powerdown_wakeup)
             GPIO.output(self._req, True)
-        time.sleep(0.5)
+        time.sleep(self.timing.powerdown_wakeup)
 
     def _wait_ready(self, timeout=10):
-        """Poll PN532 if status byte is ready, up to `timeout` seconds"""
-        time.sleep(0.01) # required after _wait_ready()
+        """Wait for the PN532 IRQ line if available, otherwise poll PN532 if
+        status byte is ready, up to `timeout` seconds"""
+        if self._irq_ready is not None:
+            return self._wait_irq(timeout)
+        time.sleep(self.timing.status_delay) # required after _wait_ready()
         status = bytearray(1)
         timestamp = time.monotonic()
         while (time.monotonic() - timestamp) < timeout:
@@ -129,7 +149,7 @@ class PN532_I2C(PN532):
                 continue
             if status == b'\x01':
                 return True  # No longer busy
-            time.sleep(0.005)  # lets ask again soon!
+            time.sleep(self.timing.poll_interval)  # lets ask again soon!
         # Timed out!
         return False
 
@@ -148,7 +168,7 @@ class PN532_I2C(PN532):
         if self.debug:
             print("Reading: ", [hex(i) for i in frame[1:]])
         else:
-            time.sleep(0.1)
+            time.sleep(self.timing.i2c_read_delay)
         return frame[1:]   # don't return the status byte
 
     def _write_data(self, framebytes):
@@ -32,6 +32,8 @@ This module will let you communicate with a PN532 NFC Hat using I2C, SPI or UART
 The main difference is the interfaces implements.
 """
 
+import threading
+from collections import namedtuple
 import RPi.GPIO as GPIO
 
 
@@ -80,11 +82,42 @@ _COMMAND_TGGETTARGETSTATUS     = 0x8A
 
 _RESPONSE_INDATAEXCHANGE       = 0x41
 _RESPONSE_INLISTPASSIVETARGET  = 0x4B
+_RESPONSE_INAUTOPOLL           = 0x61
 
 _WAKEUP                        = 0x55
 
 _MIFARE_ISO14443A              = 0x00
 
+# InAutoPoll target types
+AUTOPOLL_GENERIC_106                = 0x00
+AUTOPOLL_GENERIC_212                = 0x01
+AUTOPOLL_GENERIC_424                = 0x02
+AUTOPOLL_ISO14443_4B_106            = 0x03
+AUTOPOLL_JEWEL                      = 0x04
+AUTOPOLL_MIFARE                     = 0x10
+AUTOPOLL_FELICA_212                 = 0x11
+AUTOPOLL_FELICA_424                 = 0x12
+AUTOPOLL_ISO14443_4A                = 0x20
+AUTOPOLL_ISO14443_4B                = 0x23
+AUTOPOLL_ENDLESS                    = 0xFF
+
+# RFConfiguration items
+_RFCONFIG_FIELD                = 0x01
+_RFCONFIG_TIMINGS              = 0x02
+_RFCONFIG_MAXRTYCOM            = 0x04
+_RFCONFIG_MAXRETRIES           = 0x05
+
+RETRY_FOREVER                       = 0xFF
+
+# PowerDown wake up sources
+WAKE_INT0                           = 0x01
+WAKE_INT1                           = 0x02
+WAKE_RF_LEVEL                       = 0x08
+WAKE_HSU                            = 0x10
+WAKE_SPI                            = 0x20
+WAKE_GPIO                           = 0x40
+WAKE_I2C                            = 0x80
+
 # Mifare Commands
 MIFARE_CMD_AUTH_A                   = 0x60
 MIFARE_CMD_AUTH_B                   = 0x61
@@ -95,6 +128,22 @@ MIFARE_CMD_DECREMENT                = 0xC0
 MIFARE_CMD_INCREMENT                = 0xC1
 MIFARE_CMD_STORE                    = 0xC2
 MIFARE_ULTRALIGHT_CMD_WRITE         = 0xA2
+NTAG_CMD_FAST_READ                  = 0x3A
+
+# Pages returned by one READ, and the most we ask for in one FAST_READ so
+# the response still fits a normal information frame
+_PAGES_PER_READ                     = 4
+_FAST_READ_MAX_PAGES                = 60
+
+# Type 2 tag memory layout and TLV blocks
+_NDEF_CC_PAGE                       = 3
+_NDEF_MAGIC                         = 0xE1
+TLV_NULL                            = 0x00
+TLV_LOCK_CONTROL                    = 0x01
+TLV_MEMORY_CONTROL                  = 0x02
+TLV_NDEF_MESSAGE                    = 0x03
+TLV_PROPRIETARY                     = 0xFD
+TLV_TERMINATOR                      = 0xFE
 
 # Prefixes for NDEF Records (to identify record type)
 NDEF_URIPREFIX_NONE                 = 0x00
@@ -171,6 +220,119 @@ PN532_ERRORS = {
     0x2e: 'PN532 ERROR NONAD',
 }
 
+# A target found by InAutoPoll or InListPassiveTarget. target_type is the
+# InAutoPoll type or the baud rate passed to InListPassiveTarget. uid is the
+# NFCID1 for ISO14443A, the NFCID2 for FeliCa and the PUPI for ISO14443B;
+# sens_res and sel_res are only set for ISO14443A. data holds the remaining
+# target specific bytes.
+PassiveTarget = namedtuple('PassiveTarget',
+                           ['target_type', 'tg', 'uid', 'sens_res', 'sel_res', 'data'])
+
+def _parse_autopoll_target(target_type, data):
+    """Parse the TargetData of one InAutoPoll target."""
+    if target_type in (AUTOPOLL_GENERIC_106, AUTOPOLL_MIFARE, AUTOPOLL_ISO14443_4A):
+        # Tg, SENS_RES (2), SEL_RES, NFCIDLength, NFCID1, [ATS]
+        uid_len = data[4]
+        return PassiveTarget(target_type, data[0], bytes(data[5:5+uid_len]),
+                             bytes(data[1:3]), data[3], bytes(data[5+uid_len:]))
+    if target_type in (AUTOPOLL_GENERIC_212, AUTOPOLL_GENERIC_424,
+                       AUTOPOLL_FELICA_212, AUTOPOLL_FELICA_424):
+        # Tg, POL_RES length, 0x01, NFCID2 (8), Pad (8), [SYST_CODE (2)]
+        return PassiveTarget(target_type, data[0], bytes(data[3:11]),
+                             None, None, bytes(data[11:]))
+    if target_type in (AUTOPOLL_ISO14443_4B_106, AUTOPOLL_ISO14443_4B):
+        # Tg, ATQB (0x50, PUPI (4), application data (4), protocol info (3)),
+        # ATTRIB_RES length, ATTRIB_RES
+        return PassiveTarget(target_type, data[0], bytes(data[2:6]),
+                             None, None, bytes(data[1:]))
+    return PassiveTarget(target_type, data[0], None, None, None, bytes(data[1:]))
+
+def _tlv_header(data, offset):
+    """Return (tag, value offset, value length) of the TLV at offset, or None
+    if its header runs past the end of data."""
+    tag = data[offset]
+    if tag in (TLV_NULL, TLV_TERMINATOR):
+        return tag, offset + 1, 0
+    if offset + 2 > len(data):
+        return None
+    length = data[offset + 1]
+    if length != 0xFF:
+        return tag, offset + 2, length
+    if offset + 4 > len(data):
+        return None
+    return tag, offset + 4, data[offset + 2] << 8 | data[offset + 3]
+
+def parse_tlvs(data):
+    """Split the data area of a Type 2 tag into a list of (tag, value) tuples,
+    stopping at the terminator TLV. NULL TLVs are skipped. Raises ValueError
+    if the last TLV is cut off.
+    """
+    tlvs = []
+    offset = 0
+    while offset < len(data):
+        header = _tlv_header(data, offset)
+        if header is None:
+            raise ValueError('TLV header is truncated')
+        tag, start, length = header
+        if tag == TLV_TERMINATOR:
+            break
+        if start + length > len(data):
+            raise ValueError('TLV value is truncated')
+        if tag != TLV_NULL:
+            tlvs.append((tag, bytes(data[start:start+length])))
+        offset = start + length
+    return tlvs
+
+def _ndef_end(data):
+    """Number of bytes of the data area needed to hold the first NDEF message
+    TLV. Returns None if there is none, or len(data) + 4 if more has to be
+    read to find out.
+    """
+    offset = 0
+    while offset < len(data):
+        header = _tlv_header(data, offset)
+        if header is None:
+            break
+        tag, start, length = header
+        if tag == TLV_TERMINATOR:
+            return None
+        if tag == TLV_NDEF_MESSAGE:
+            return start + length
+        offset = start + length
+    return max(offset, len(data)) + 4
+
+# Delays in seconds used by the transports. TIMING_CONSERVATIVE matches the
+# fixed sleeps the library always used, TIMING_FAST is close to the
+# datasheet minimums. Use calibrate_timing to find what a board can do.
+TimingProfile = namedtuple('TimingProfile', [
+    'cs_delay',             # SPI chip select setup and hold
+    'status_delay',         # before each status poll
+    'poll_interval',        # between status polls
+    'write_delay',          # SPI, before writing a frame
+    'read_delay',           # SPI, before reading a frame
+    'i2c_read_delay',       # I2C, after reading a frame
+    'reset_high',           # reset pin high before and after the pulse
+    'reset_low',            # reset pulse length
+    'spi_wakeup_delay',     # SPI, before and after the wakeup byte
+    'i2c_wakeup_delay',     # I2C, after the H_Request pulse
+    'req_pulse',            # I2C, H_Request pulse length
+    'powerdown_wakeup',     # leaving PowerDown, about T_osc_start
+])
+
+TIMING_CONSERVATIVE = TimingProfile(
+    cs_delay=0.001, status_delay=0.01, poll_interval=0.005, write_delay=0.02,
+    read_delay=0.005, i2c_read_delay=0.1, reset_high=0.1, reset_low=0.5,
+    spi_wakeup_delay=1, i2c_wakeup_delay=0.5, req_pulse=0.1, powerdown_wakeup=0.01)
+
+TIMING_FAST = TimingProfile(
+    cs_delay=0, status_delay=0.001, poll_interval=0.001, write_delay=0,
+    read_delay=0, i2c_read_delay=0, reset_high=0.01, reset_low=0.01,
+    spi_wakeup_delay=0.002, i2c_wakeup_delay=0.002, req_pulse=0.001, powerdown_wakeup=0.002)
+
+# Only these are exercised by a plain command and can be calibrated
+_PER_COMMAND_DELAYS = ('cs_delay', 'status_delay', 'poll_interval', 'write_delay',
+                       'read_delay', 'i2c_read_delay')
+
 class PN532Error(Exception):
     """PN532 error code"""
     def __init__(self, err):
@@ -186,10 +348,25 @@ class BusyError(Exception):
 class PN532:
     """PN532 driver base, must be extended for I2C/SPI/UART interfacing"""
 
-    def __init__(self, *, debug=False, reset=None):
-        """Create an instance of the PN532 class
+    # Wake up source of the host interface, set by each transport
+    _WAKE_HOST = 0
+
+    def __init__(self, *, debug=False, reset=None, fast_start=False):
+        """Create an instance of the PN532 class. With fast_start the PN532
+        is probed first and only woken up, and then reset, if it does not
+        answer.
         """
         self.debug = debug
+        self.firmware_version = None
+        if fast_start:
+            # Still awake from the last run? Then there is nothing to do.
+            if self._probe():
+                return
+            if debug:
+                print("No answer, waking up")
+            self._wakeup()
+            if self._probe():
+                return
         if reset:
             if debug:
                 print("Resetting")
@@ -197,11 +374,28 @@ class PN532:
 
         try:
             self._wakeup()
-            self.get_firmware_version() # first time often fails, try 2ce
+            self.firmware_version = self.get_firmware_version() # first time often fails, try 2ce
             return
         except (BusyError, RuntimeError):
             pass
-        self.get_firmware_version()
+        self.firmware_version = self.get_firmware_version()
+
+    def _probe(self):
+        """Return True if the PN532 answers GetFirmwareVersion."""
+        try:
+            self.firmware_version = self.get_firmware_version()
+        except (BusyError, RuntimeError, OSError):
+            return False
+        return True
+
+    @property
+    def timing(self):
+        """TimingProfile with the delays used by the transport."""
+        return self._timing
+
+    @timing.setter
+    def timing(self, profile):
+        self._timing = profile
 
     def _gpio_init(self, **kwargs):
         # Hardware GPIO init
@@ -211,6 +405,32 @@ class PN532:
         # Perform a hardware reset toggle
         raise NotImplementedError
 
+    def _irq_init(self):
+        """Arm falling edge detection on the IRQ pin. If no IRQ pin is given
+        or edge detection is not available, _wait_ready keeps polling the
+        status byte instead."""
+        self._irq_ready = None
+        if not self._irq:
+            return
+        irq_ready = threading.Event()
+        try:
+            GPIO.add_event_detect(self._irq, GPIO.FALLING,
+                                  callback=lambda channel: irq_ready.set())
+        except RuntimeError as err:
+            if self.debug:
+                print("IRQ edge detection unavailable, polling instead:", err)
+            return
+        self._irq_ready = irq_ready
+
+    def _wait_irq(self, timeout):
+        """Block until the PN532 pulls IRQ low to signal a pending response,
+        up to `timeout` seconds"""
+        self._irq_ready.clear()
+        # The line may already be low if the response arrived before we got here
+        if GPIO.input(self._irq) == GPIO.LOW:
+            return True
+        return self._irq_ready.wait(timeout)
+
     def _read_data(self, count):
         # Read raw data from device, not including status bytes:
         # Subclasses MUST implement this!
@@ -282,7 +502,13 @@ class PN532:
             raise RuntimeError('Response contains no data!')
         # Check length & length checksum match.
         frame_len = response[offset]
-        if (frame_len + response[offset+1]) & 0xFF != 0:
+        if frame_len == 0xFF and response[offset+1] == 0xFF:
+            # Extended frame: 0xFF 0xFF, length MSB, length LSB, checksum
+            frame_len = response[offset+2] << 8 | response[offset+3]
+            if sum(response[offset+2:offset+5]) & 0xFF != 0:
+                raise RuntimeError('Response length checksum did not match length!')
+            offset += 3
+        elif (frame_len + response[offset+1]) & 0xFF != 0:
             raise RuntimeError('Response length checksum did not match length!')
         # Check frame checksum value matches bytes.
         checksum = sum(response[offset+2:offset+2+frame_len+1]) & 0xFF
@@ -347,6 +573,36 @@ class PN532:
         # check the command was executed as expected.
         self.call_function(_COMMAND_SAMCONFIGURATION, params=[0x01, 0x14, 0x01])
 
+    def rf_configure(self, field=None, auto_rfca=False, timings=None,
+                     max_retry_com=None, max_retries=None):
+        """Configure the RF settings of the PN532 with RFConfiguration. Only
+        the items that are not None are sent.
+        :params field: <bool> switch the RF field on or off
+        :params auto_rfca: <bool> use RF collision avoidance when switching
+        the field on
+        :params timings: tuple (atr_res_timeout, retry_timeout) of timeout
+        codes, 0x0B = 102.4 ms, 0x0A = 51.2 ms ... 0x01 = 100 us
+        :params max_retry_com: number of retries of InCommunicateThru and
+        InDataExchange on timeout, 0 by default
+        :params max_retries: tuple (mx_rty_atr, mx_rty_psl,
+        mx_rty_passive_activation), RETRY_FOREVER retries without limit. A
+        bounded mx_rty_passive_activation makes InListPassiveTarget answer
+        "no card" instead of waiting for the host to give up.
+        """
+        if field is not None:
+            self.call_function(_COMMAND_RFCONFIGURATION,
+                               params=[_RFCONFIG_FIELD, (0x02 if auto_rfca else 0x00) | (0x01 if field else 0x00)])
+        if timings is not None:
+            atr_res_timeout, retry_timeout = timings
+            self.call_function(_COMMAND_RFCONFIGURATION,
+                               params=[_RFCONFIG_TIMINGS, 0x00, atr_res_timeout, retry_timeout])
+        if max_retry_com is not None:
+            self.call_function(_COMMAND_RFCONFIGURATION,
+                               params=[_RFCONFIG_MAXRTYCOM, max_retry_com & 0xFF])
+        if max_retries is not None:
+            self.call_function(_COMMAND_RFCONFIGURATION,
+                               params=[_RFCONFIG_MAXRETRIES] + [r & 0xFF for r in max_retries])
+
     def read_passive_target(self, card_baud=_MIFARE_ISO14443A, timeout=1):
         """Wait for a MiFare card to be available and return its UID when found.
         Will wait up to timeout seconds and return None if no card is found,
@@ -363,6 +619,9 @@ class PN532:
         # If no response is available return None to indicate no card is present.
         if response is None:
             return None
+        # With bounded passive activation retries the PN532 reports 0 targets.
+        if response[0] == 0x00:
+            return None
         # Check only 1 card with up to a 7 byte UID is present.
         if response[0] != 0x01:
             raise RuntimeError('More than one card detected!')
@@ -371,6 +630,125 @@ class PN532:
         # Return UID of card.
         return response[6:6+response[5]]
 
+    def read_passive_targets(self, max_targets=2, card_baud=_MIFARE_ISO14443A, timeout=1):
+        """Like read_passive_target, but lets the PN532 activate up to
+        max_targets (1 or 2) ISO14443A cards at once through its
+        anti-collision loop. Returns a list of PassiveTarget with the UID,
+        SENS_RES, SEL_RES and ATS (as data) of every card found, which is
+        empty if there is no card or no answer within timeout seconds.
+        """
+        assert 1 <= max_targets <= 2, 'The PN532 can activate at most 2 targets.'
+        try:
+            response = self.call_function(_COMMAND_INLISTPASSIVETARGET,
+                                          params=[max_targets, card_baud],
+                                          response_length=64,
+                                          timeout=timeout)
+        except BusyError:
+            return []
+        if response is None:
+            return []
+        targets = []
+        offset = 1
+        for _ in range(response[0]):
+            # Tg, SENS_RES (2), SEL_RES, NFCIDLength, NFCID1, [ATS]
+            uid_len = response[offset+4]
+            tg, sens_res, sel_res = response[offset], bytes(response[offset+1:offset+3]), response[offset+3]
+            uid = bytes(response[offset+5:offset+5+uid_len])
+            offset += 5 + uid_len
+            ats = b''
+            # ISO14443-4 compliant cards also send an ATS, its first byte is its length
+            if sel_res & 0x20 and offset < len(response):
+                ats = bytes(response[offset:offset+response[offset]])
+                offset += len(ats)
+            targets.append(PassiveTarget(card_baud, tg, uid, sens_res, sel_res, ats))
+        return targets
+
+    def auto_poll(self, types=(AUTOPOLL_MIFARE, AUTOPOLL_FELICA_212,
+                               AUTOPOLL_FELICA_424, AUTOPOLL_ISO14443_4B),
+                  poll_nr=AUTOPOLL_ENDLESS, period=1, timeout=5):
+        """Let the PN532 poll for the given target types on its own, every
+        period * 150 ms and poll_nr times (0xFF polls until a target shows
+        up). Returns a list of PassiveTarget, an empty list if the PN532
+        finished polling without a target, or None if nothing was found
+        within timeout seconds, in which case polling is aborted.
+        """
+        assert 1 <= len(types) <= 15, 'Between 1 and 15 target types can be polled.'
+        try:
+            response = self.call_function(_COMMAND_INAUTOPOLL,
+                                          params=[poll_nr, period] + list(types),
+                                          response_length=64,
+                                          timeout=timeout)
+        except BusyError:
+            response = None
+        if response is None:
+            # Sending an ACK frame aborts the command still running on the PN532
+            self._write_data(_ACK)
+            return None
+        targets = []
+        offset = 1
+        for _ in range(response[0]):
+            target_type, length = response[offset], response[offset+1]
+            data = response[offset+2:offset+2+length]
+            targets.append(_parse_autopoll_target(target_type, data))
+            offset += 2 + length
+        return targets
+
+    def in_release(self, tg=0):
+        """Release target tg, or all targets if tg is 0, with InRelease. The
+        PN532 forgets the target and has to activate it again before any
+        further exchange. Returns True on success.
+        """
+        return self._release_target(_COMMAND_INRELEASE, tg)
+
+    def in_deselect(self, tg=0):
+        """Deselect target tg, or all targets if tg is 0, with InDeselect. The
+        PN532 keeps the target information so it can be selected again with
+        InSelect. Returns True on success.
+        """
+        return self._release_target(_COMMAND_INDESELECT, tg)
+
+    def _release_target(self, command, tg):
+        response = self.call_function(command, params=[tg & 0xFF], response_length=1)
+        if response is None:
+            return False
+        # Bits 0-5 of the status byte hold the error code
+        if response[0] & 0x3F:
+            raise PN532Error(response[0] & 0x3F)
+        return True
+
+    def power_down(self, wake_sources=None, generate_irq=False):
+        """Put the PN532 into power down mode with PowerDown.  The RF field is
+        switched off until one of wake_sources, a combination of the WAKE_*
+        flags, wakes the chip up.  By default these are the host interface in
+        use and the RF level detector, which reacts to an external field such
+        as a phone, not to a passive card.  With generate_irq the IRQ pin goes
+        low when the chip wakes up by itself.  Call wake_up before the next
+        command.  Returns True on success.
+        """
+        if wake_sources is None:
+            wake_sources = self._WAKE_HOST | WAKE_RF_LEVEL
+        params = [wake_sources & 0xFF]
+        if generate_irq:
+            params.append(0x01)
+        response = self.call_function(_COMMAND_POWERDOWN, params=params, response_length=1)
+        if response is None:
+            return False
+        if response[0] & 0x3F:
+            raise PN532Error(response[0] & 0x3F)
+        return True
+
+    def wake_up(self):
+        """Wake the PN532 up after power_down.  Unlike the wakeup after power
+        on this only waits for the oscillator to restart, the powerdown_wakeup
+        delay of the timing profile.
+        """
+        self._wake_from_powerdown()
+
+    def _wake_from_powerdown(self):
+        """Transport specific wakeup from PowerDown, the full wakeup unless
+        overridden."""
+        self._wakeup()
+
     def mifare_classic_authenticate_block(self, uid, block_number, key_number, key):   # pylint: disable=invalid-name
         """Authenticate specified block number for a MiFare classic card.  Uid
         should be a byte array with the UID of the card, block number should be
@@ -463,6 +841,90 @@ class PN532:
         """
         return self.mifare_classic_read_block(block_number)[0:4] # only 4 bytes per page
 
+    def _read_four_pages(self, page):
+        # READ always returns 16 bytes, wrapping around at the end of memory
+        response = self.call_function(_COMMAND_INDATAEXCHANGE,
+                                      params=[0x01, MIFARE_CMD_READ, page & 0xFF],
+                                      response_length=17)
+        if response is None:
+            return None
+        if response[0] & 0x3F:
+            raise PN532Error(response[0] & 0x3F)
+        return response[1:]
+
+    def _fast_read(self, start, end):
+        # FAST_READ is sent raw with InCommunicateThru, the PN532 adds the CRC
+        response = self.call_function(_COMMAND_INCOMMUNICATETHRU,
+                                      params=[NTAG_CMD_FAST_READ, start & 0xFF, end & 0xFF],
+                                      response_length=1+(end-start+1)*4)
+        if response is None:
+            return None
+        if response[0] & 0x3F:
+            raise PN532Error(response[0] & 0x3F)
+        return response[1:]
+
+    def read_pages(self, start, count, fast_read=False):
+        """Read count 4 byte pages of an NTAG2xx or Ultralight tag starting at
+        page start.  Every READ brings back four pages, so this needs a quarter
+        of the exchanges of ntag2xx_read_block.  Set fast_read to use FAST_READ,
+        which reads up to 60 pages at once; only NTAG21x tags support it and
+        others stop answering until selected again.  Returns a bytearray of
+        count * 4 bytes, or None if the card did not respond.
+        """
+        data = bytearray()
+        page = start
+        end = start + count
+        while page < end:
+            if fast_read:
+                last = min(end, page + _FAST_READ_MAX_PAGES) - 1
+                chunk = self._fast_read(page, last)
+            else:
+                chunk = self._read_four_pages(page)
+            if chunk is None:
+                return None
+            if len(chunk) < 4:
+                raise RuntimeError('Tag returned no data!')
+            data += chunk
+            page += len(chunk) // 4
+        return data[:count*4]
+
+    def read_ndef(self, fast_read=False):
+        """Read the NDEF message stored on an NTAG2xx or Ultralight tag.  The
+        capability container and the start of the data area come in with the
+        first READ, so a short message costs one exchange and a longer one
+        two.  Returns the message as bytes, None if the tag is not NDEF
+        formatted or holds no message.
+        """
+        head = self.read_pages(_NDEF_CC_PAGE, _PAGES_PER_READ, fast_read)
+        if head is None or head[0] != _NDEF_MAGIC:
+            return None
+        # CC byte 2 is the size of the data area in units of 8 bytes
+        area_size = head[2] * 8
+        data = head[4:]
+        first_page = _NDEF_CC_PAGE + 1
+        while True:
+            end = _ndef_end(data)
+            if end is None:
+                return None
+            if end > area_size:
+                if len(data) >= area_size:
+                    raise ValueError('NDEF message runs past the data area')
+                end = area_size
+            if end <= len(data):
+                break
+            count = (end - len(data) + 3) // 4
+            if not fast_read:
+                # Every READ brings back four pages, keep all of them
+                count = -(-count // _PAGES_PER_READ) * _PAGES_PER_READ
+            more = self.read_pages(first_page + len(data) // 4, count, fast_read)
+            if more is None:
+                return None
+            data += more
+        for tag, value in parse_tlvs(data[:end]):
+            if tag == TLV_NDEF_MESSAGE:
+                return value
+        return None
+
     def read_gpio(self, pin=None):
         """Read the state of the PN532's GPIO pins.
         :params pin: <str> specified the pin to read
@@ -592,3 +1054,25 @@ class PN532:
             mode_activated = response[0]
             initiator_command = response[1:]
             return (mode_activated, initiator_command)
+
+def calibrate_timing(pn532, floor=TIMING_FAST, steps=8, attempts=3):
+    """Shorten the per-command delays of `pn532` step by step from its
+    current profile towards `floor`, as long as get_firmware_version keeps
+    succeeding `attempts` times in a row. Reset and wakeup delays are left
+    alone. The fastest working profile is set on `pn532` and returned.
+    """
+    start = good = pn532.timing
+    for step in range(1, steps+1):
+        k = 1 - step / steps
+        profile = start._replace(**{
+            name: getattr(floor, name) + (getattr(start, name) - getattr(floor, name)) * k
+            for name in _PER_COMMAND_DELAYS})
+        pn532.timing = profile
+        try:
+            for _ in range(attempts):
+                pn532.get_firmware_version()
+        except (BusyError, RuntimeError, OSError):
+            break
+        good = profile
+    pn532.timing = good
+    return good
@@ -33,7 +33,7 @@ using SPI on the Raspberry Pi.
 import time
 import spidev
 import RPi.GPIO as GPIO
-from .pn532 import PN532
+from .pn532 import PN532, TIMING_CONSERVATIVE, WAKE_SPI
 
 # pylint: disable=bad-whitespace
 _SPI_STATREAD                  = 0x02
@@ -41,10 +41,14 @@ _SPI_DATAWRITE                 = 0x01
 _SPI_DATAREAD                  = 0x03
 _SPI_READY                     = 0x01
 
+# Number of distinct write frames kept already bit-reversed
+_TX_CACHE_SIZE                 = 32
+
 
 class SPIDevice:
     """Implements SPI device on spidev"""
-    def __init__(self, cs=None):
+    def __init__(self, cs=None, timing=TIMING_CONSERVATIVE):
+        self.timing = timing
         self.spi = spidev.SpiDev(0, 0)
         GPIO.setmode(GPIO.BCM)
         self._cs = cs
@@ -53,34 +57,36 @@ class SPIDevice:
             GPIO.output(self._cs, GPIO.HIGH)
         self.spi.max_speed_hz = 1000000
         self.spi.mode = 0b10    # CPOL=1 & CPHA=0
+        # writebytes2 takes any buffer without converting it to a list first
+        self._writebytes = getattr(self.spi, 'writebytes2', self.spi.writebytes)
 
     def writebytes(self, buf):
         if self._cs:
             GPIO.output(self._cs, GPIO.LOW)
-            time.sleep(0.001);
-        ret = self.spi.writebytes(list(buf))
+            time.sleep(self.timing.cs_delay)
+        ret = self._writebytes(buf)
         if self._cs:
-            time.sleep(0.001);
+            time.sleep(self.timing.cs_delay)
             GPIO.output(self._cs, GPIO.HIGH)
         return ret
 
     def readbytes(self, count):
         if self._cs:
             GPIO.output(self._cs, GPIO.LOW)
-            time.sleep(0.001);
+            time.sleep(self.timing.cs_delay)
         ret = bytearray(self.spi.readbytes(count))
         if self._cs:
-            time.sleep(0.001);
+            time.sleep(self.timing.cs_delay)
             GPIO.output(self._cs, GPIO.HIGH)
         return ret
 
     def xfer(self, buf):
         if self._cs:
             GPIO.output(self._cs, GPIO.LOW)
-            time.sleep(0.001);
+            time.sleep(self.timing.cs_delay)
         buf = bytearray(self.spi.xfer(buf))
         if self._cs:
-            time.sleep(0.001);
+            time.sleep(self.timing.cs_delay)
             GPIO.output(self._cs, GPIO.HIGH)
         return buf
 
@@ -96,16 +102,36 @@ def reverse_bit(num):
     return result
 
 
+# reverse_bit of every byte value, for use with bytes.translate
+_REVERSE_TABLE = bytes(reverse_bit(i) for i in range(256))
+_STATUS_FRAME = bytes([reverse_bit(_SPI_STATREAD), 0])
+
+
 class PN532_SPI(PN532):
     """Driver for the PN532 connected over SPI. Pass in a hardware SPI device
-    & chip select digitalInOut pin. Optional IRQ pin (not used), reset pin and
-    debugging output."""
-    def __init__(self, cs=None, irq=None, reset=None, debug=False):
+    & chip select digitalInOut pin. Optional IRQ pin (waits on its falling
+    edge instead of polling the status byte), reset pin and debugging output.
+    `timing` is the TimingProfile for the delays on the bus. With
+    `fast_start` the reset and wakeup are skipped if the PN532 answers."""
+
+    _WAKE_HOST = WAKE_SPI
+
+    def __init__(self, cs=None, irq=None, reset=None, debug=False, timing=TIMING_CONSERVATIVE,
+                 fast_start=False):
         """Create an instance of the PN532 class using SPI"""
         self.debug = debug
+        self.timing = timing
+        self._rx_frames = {}
+        self._tx_frames = {}
         self._gpio_init(cs=cs, irq=irq, reset=reset)
-        self._spi = SPIDevice(cs)
-        super().__init__(debug=debug, reset=reset)
+        self._spi = SPIDevice(cs, timing)
+        super().__init__(debug=debug, reset=reset, fast_start=fast_start)
+
+    @PN532.timing.setter
+    def timing(self, profile):
+        self._timing = profile
+        if hasattr(self, '_spi'):
+            self._spi.timing = profile
 
     def _gpio_init(self, reset=None, cs=None, irq=None):
         self._cs = cs
@@ -119,49 +145,61 @@ class PN532_SPI(PN532):
             GPIO.output(cs, True)
         if irq:
             GPIO.setup(irq, GPIO.IN)
+        self._irq_init()
 
     def _reset(self, pin):
         """Perform a hardware reset toggle"""
         GPIO.output(pin, True)
-        time.sleep(0.1)
+        time.sleep(self.timing.reset_high)
         GPIO.output(pin, False)
-        time.sleep(0.5)
+        time.sleep(self.timing.reset_low)
         GPIO.output(pin, True)
-        time.sleep(0.1)
+        time.sleep(self.timing.reset_high)
 
     def _wakeup(self):
         """Send any special commands/data to wake up PN532"""
-        time.sleep(1)
+        time.sleep(self.timing.spi_wakeup_delay)
         if self._cs:
             GPIO.output(self._cs, GPIO.LOW)
         time.sleep(0.002)   # T_osc_start
         self._spi.writebytes(bytearray([0x00])) #pylint: disable=no-member
-        time.sleep(1)
+        time.sleep(self.timing.spi_wakeup_delay)
+
+    def _wake_from_powerdown(self):
+        """Wake up from PowerDown: the falling edge of NSS restarts the
+        oscillator, which needs T_osc_start before the next frame."""
+        if self._cs:
+            GPIO.output(self._cs, GPIO.LOW)
+        self._spi.writebytes(bytearray([0x00])) #pylint: disable=no-member
+        time.sleep(self.timing.powerdown_wakeup)
 
     def _wait_ready(self, timeout=1):
-        """Poll PN532 if status byte is ready, up to `timeout` seconds"""
-        status = bytearray([reverse_bit(_SPI_STATREAD), 0])
+        """Wait for the PN532 IRQ line if available, otherwise poll PN532 if
+        status byte is ready, up to `timeout` seconds"""
+        if self._irq_ready is not None:
+            return self._wait_irq(timeout)
         timestamp = time.monotonic()
         while (time.monotonic() - timestamp) < timeout:
-            time.sleep(0.01)   # required
-            status = self._spi.xfer(status) #pylint: disable=no-member
-            if reverse_bit(status[1]) == _SPI_READY:  # LSB data is read in MSB
+            time.sleep(self.timing.status_delay)   # required
+            status = self._spi.xfer(_STATUS_FRAME) #pylint: disable=no-member
+            if _REVERSE_TABLE[status[1]] == _SPI_READY:  # LSB data is read in MSB
                 return True      # Not busy anymore!
             else:
-                time.sleep(0.005)  # pause a bit till we ask again
+                time.sleep(self.timing.poll_interval)  # pause a bit till we ask again
         # We timed out!
         return False
 
     def _read_data(self, count):
         """Read a specified count of bytes from the PN532."""
-        # Build a read request frame.
-        frame = bytearray(count+1)
-        # Add the SPI data read signal byte, but LSB'ify it
-        frame[0] = reverse_bit(_SPI_DATAREAD)
-        time.sleep(0.005)   # required
-        frame = self._spi.xfer(frame) #pylint: disable=no-member
-        for i, val in enumerate(frame):
-            frame[i] = reverse_bit(val) # turn LSB data to MSB
+        # Read request frames are built once per size: the LSB'ified SPI
+        # data read signal byte followed by count dummy bytes
+        request = self._rx_frames.get(count)
+        if request is None:
+            request = bytes([reverse_bit(_SPI_DATAREAD)]) + bytes(count)
+            self._rx_frames[count] = request
+        time.sleep(self.timing.read_delay)   # required
+        frame = self._spi.xfer(request) #pylint: disable=no-member
+        frame = frame.translate(_REVERSE_TABLE) # turn LSB data to MSB
         if self.debug:
             print("Reading: ", [hex(i) for i in frame[1:]])
         return frame[1:]
@@ -169,9 +207,14 @@ class PN532_SPI(PN532):
     def _write_data(self, framebytes):
         """Write a specified count of bytes to the PN532"""
         # start by making a frame with data write in front,
-        # then rest of bytes, and LSBify it
-        rev_frame = [reverse_bit(x) for x in bytes([_SPI_DATAWRITE]) + framebytes]
+        # then rest of bytes, and LSBify it. Frames of repeated commands
+        # such as InListPassiveTarget or ACK are reused.
+        rev_frame = self._tx_frames.get(framebytes)
+        if rev_frame is None:
+            rev_frame = (bytes([_SPI_DATAWRITE]) + framebytes).translate(_REVERSE_TABLE)
+            if len(self._tx_frames) < _TX_CACHE_SIZE:
+                self._tx_frames[framebytes] = rev_frame
         if self.debug:
             print("Writing: ", [hex(i) for i in rev_frame])
-        time.sleep(0.02)   # required
-        self._spi.writebytes(bytes(rev_frame))
+        time.sleep(self.timing.write_delay)   # required
+        self._spi.writebytes(rev_frame)
@@ -30,36 +30,118 @@ using UART (ttyS0) on the Raspberry Pi.
 """
 
 
+import select
 import time
+from collections import deque
 import serial
 import RPi.GPIO as GPIO
-from .pn532 import PN532, BusyError
+from .pn532 import PN532, BusyError, TIMING_CONSERVATIVE, _ACK, WAKE_HSU
 
 
 # pylint: disable=bad-whitespace
 DEV_SERIAL          = '/dev/ttyS0'
 BAUD_RATE           = 115200
 
+_NACK               = b'\x00\x00\xFF\xFF\x00\x00'
+_START_CODE         = b'\x00\xFF'
+
+
+class FrameDecoder:
+    """Incremental decoder for the PN532 frames arriving on the UART. Bytes
+    are fed in as they arrive, and every complete ACK, NACK, error, normal
+    or extended frame is queued in `frames` with its preamble and start
+    code. Garbage is skipped by resynchronizing on the 00 FF start code.
+    Data checksums are left to PN532._read_frame."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.frames = deque()
+
+    def reset(self):
+        self._buffer.clear()
+        self.frames.clear()
+
+    def feed(self, data):
+        """Add received bytes. Returns True if a complete frame is queued."""
+        self._buffer += data
+        while self._decode():
+            pass
+        return bool(self.frames)
+
+    def _decode(self):
+        # Decode one frame from the buffer, True if the buffer got shorter
+        buf = self._buffer
+        start = buf.find(_START_CODE)
+        if start < 0:
+            # Keep a trailing 0x00, it may be the first half of a start code
+            keep = 1 if buf[-1:] == b'\x00' else 0
+            del buf[:len(buf) - keep]
+            return False
+        if start:
+            del buf[:start]
+            return True
+        if len(buf) < 4:
+            return False
+        length, lcs = buf[2], buf[3]
+        if (length, lcs) in ((0x00, 0xFF), (0xFF, 0x00)):
+            # ACK or NACK, followed by the postamble
+            if len(buf) < 5:
+                return False
+            self.frames.append(_ACK if length == 0x00 else _NACK)
+            del buf[:5]
+            return True
+        if length == 0xFF and lcs == 0xFF:
+            # Extended frame: length MSB, length LSB, length checksum
+            if len(buf) < 7:
+                return False
+            if sum(buf[4:7]) & 0xFF:
+                del buf[:2]
+                return True
+            length = buf[4] << 8 | buf[5]
+            header = 7
+        elif (length + lcs) & 0xFF:
+            # Not a real start code, look for the next one
+            del buf[:2]
+            return True
+        else:
+            header = 4
+        # Data, data checksum and postamble follow the header
+        end = header + length + 2
+        if len(buf) < end:
+            return False
+        self.frames.append(b'\x00' + bytes(buf[:end]))
+        del buf[:end]
+        return True
+
 
 class PN532_UART(PN532):
     """Driver for the PN532 connected over UART. Pass in a hardware UART device.
-    Optional IRQ pin (not used), reset pin and debugging output. 
+    Optional IRQ pin (not used), reset pin and debugging output. Incoming
+    bytes are decoded into frames as they arrive.
     """
+
+    _WAKE_HOST = WAKE_HSU
+
     def __init__(self, dev=DEV_SERIAL, baudrate=BAUD_RATE,
-                irq=None, reset=None, debug=False):
+                irq=None, reset=None, debug=False, timing=TIMING_CONSERVATIVE,
+                fast_start=False):
         """Create an instance of the PN532 class using UART
         before running __init__, you should
         1.  disable serial login shell
         2.  enable serial port hardware
         using 'sudo raspi-config' --> 'Interfacing Options' --> 'Serial'
+        `timing` is the TimingProfile for the delays on the line. With
+        `fast_start` the reset and wakeup are skipped if the PN532 answers.
         """
 
         self.debug = debug
+        self.timing = timing
+        self._decoder = FrameDecoder()
         self._gpio_init(irq=irq, reset=reset)
         self._uart = serial.Serial(dev, baudrate)
         if not self._uart.is_open:
             raise RuntimeError('cannot open {0}'.format(dev))
-        super().__init__(debug=debug, reset=reset)
+        super().__init__(debug=debug, reset=reset, fast_start=fast_start)
 
     def _gpio_init(self, reset=None,irq=None):
         self._irq = irq
@@ -73,40 +155,58 @@ class PN532_UART(PN532):
     def _reset(self, pin):
         """Perform a hardware reset toggle"""
         GPIO.output(pin, True)
-        time.sleep(0.1)
+        time.sleep(self.timing.reset_high)
         GPIO.output(pin, False)
-        time.sleep(0.5)
+        time.sleep(self.timing.reset_low)
         GPIO.output(pin, True)
-        time.sleep(0.1)
+        time.sleep(self.timing.reset_high)
 
     def _wakeup(self):
         """Send any special commands/data to wake up PN532"""
         self._uart.write(b'\x55\x55\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00') # wake up!
         self.SAM_configuration()
 
+    def _wake_from_powerdown(self):
+        """Wake up from PowerDown. The configuration survives PowerDown, so
+        unlike _wakeup there is no need to repeat SAMConfiguration."""
+        self._uart.write(b'\x55\x55\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+        time.sleep(self.timing.powerdown_wakeup)
+
+    def _receive(self):
+        """Feed everything waiting on the UART to the frame decoder."""
+        waiting = self._uart.in_waiting
+        if waiting:
+            self._decoder.feed(self._uart.read(waiting))
+
     def _wait_ready(self, timeout=0.001):
-        """Wait for response frame, up to `timeout` seconds"""
-        timestamp = time.monotonic()
-        while (time.monotonic() - timestamp) < timeout:
-            if self._uart.in_waiting:
-                return True
-            else:
-                time.sleep(0.05)  # lets ask again soon!
-        # Timed out!
-        return False
+        """Wait for a complete response frame, up to `timeout` seconds"""
+        deadline = time.monotonic() + timeout
+        self._receive()
+        while not self._decoder.frames:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # Timed out!
+                return False
+            # Sleep until the next bytes arrive
+            select.select([self._uart.fileno()], [], [], remaining)
+            self._receive()
+        return True
 
     def _read_data(self, count):
-        """Read a specified count of bytes from the PN532."""
-        frame = self._uart.read(min(self._uart.in_waiting, count))
-        if not frame:
+        """Return the next complete frame from the PN532. `count` is only
+        an upper bound, frames are always returned whole."""
+        if not self._decoder.frames:
+            self._receive()
+        if not self._decoder.frames:
             raise BusyError("No data read from PN532")
+        frame = self._decoder.frames.popleft()
         if self.debug:
             print("Reading: ", [hex(i) for i in frame])
-        else:
-            time.sleep(0.005)
         return frame
 
     def _write_data(self, framebytes):
         """Write a specified count of bytes to the PN532"""
-        self._uart.read(self._uart.in_waiting)    # clear FIFO queue of UART
+        # Frames left over from an earlier command are stale now
+        self._uart.reset_input_buffer()
+        self._decoder.reset()
         self._uart.write(framebytes)
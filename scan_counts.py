@@ -0,0 +1,73 @@
+"""
+This module keeps the per-card scan counts in memory and writes them back to
+card_scans.csv in batches, so a tap does not cost a full rewrite of the file.
+"""
+
+import asyncio
+import csv
+import logging
+import os
+import tempfile
+
+
+class ScanCounter:
+    """Scan counts per UID, loaded once from the CSV file. Dirty counts are
+    flushed after `max_dirty` updates, on a timer, or on shutdown. The file
+    is replaced atomically so readers always see a complete CSV."""
+
+    def __init__(self, path, max_dirty=20, flush_interval=60):
+        self.path = path
+        self.max_dirty = max_dirty
+        self.flush_interval = flush_interval
+        self.counts = {}
+        self._dirty = 0
+        self.load()
+
+    def load(self):
+        self.counts = {}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, mode='r', newline='') as file:
+            reader = csv.reader(file)
+            for row in reader:
+                if len(row) < 2 or row[0] == 'UID':
+                    continue
+                try:
+                    self.counts[row[0]] = int(row[1])
+                except ValueError:
+                    logging.error(f"Skipping malformed row in {self.path}: {row}")
+
+    def increment(self, uid):
+        self.counts[uid] = self.counts.get(uid, 0) + 1
+        self._dirty += 1
+        if self._dirty >= self.max_dirty:
+            self.flush()
+
+    def flush(self):
+        """Write all counts to a temporary file and rename it over the CSV."""
+        if not self._dirty and os.path.exists(self.path):
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.card_scans.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, mode='w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(['UID', 'Count'])
+                writer.writerows(self.counts.items())
+                file.flush()
+                os.fsync(file.fileno())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._dirty = 0
+
+    async def run_flusher(self):
+        """Flush pending counts every `flush_interval` seconds."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                logging.error(f"Failed to write {self.path}: {e}")
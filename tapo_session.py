@@ -0,0 +1,194 @@
+"""
+This module keeps a single authenticated session to the Tapo P110 plug
+alive, so switching the relay only costs one on/off RPC instead of a full
+login handshake.
+"""
+
+import asyncio
+import logging
+import time
+
+
+class TapoSession:
+    """Long-lived session to a Tapo P110. Logs in once, keeps the device
+    handle warm, refreshes it in the background before the token expires
+    and reconnects transparently when a call fails."""
+
+    def __init__(self, username, password, ip_address, connect_timeout=3,
+                 refresh_interval=3600, client_factory=None):
+        self._username = username
+        self._password = password
+        self._ip_address = ip_address
+        self._connect_timeout = connect_timeout
+        self._refresh_interval = refresh_interval
+        if client_factory is None:
+            from tapo import ApiClient
+            client_factory = ApiClient
+        self._client_factory = client_factory
+        self._device = None
+        self._lock = asyncio.Lock()
+        self._refresh_task = None
+        self.connected_at = None
+
+    async def start(self):
+        """Log in and start the background refresh task."""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+        try:
+            await self._get_device()
+        except (asyncio.TimeoutError, Exception) as e:
+            logging.error(f"Failed to connect to the Tapo device: {e}")
+
+    async def close(self):
+        """Stop the refresh task and drop the device handle."""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        self._device = None
+
+    async def _connect(self):
+        client = self._client_factory(self._username, self._password)
+        self._device = await asyncio.wait_for(client.p110(self._ip_address),
+                                              timeout=self._connect_timeout)
+        self.connected_at = time.monotonic()
+        logging.info("Connected to the Tapo device.")
+        return self._device
+
+    async def _get_device(self):
+        if self._device is not None:
+            return self._device
+        async with self._lock:
+            # Another caller may have connected while we waited on the lock
+            if self._device is not None:
+                return self._device
+            return await self._connect()
+
+    async def set_power(self, turn_on):
+        """Switch the relay. A failed call on a stale handle is retried once
+        over a fresh connection before the error is raised."""
+        for attempt in range(2):
+            device = await self._get_device()
+            try:
+                call = device.on() if turn_on else device.off()
+                await asyncio.wait_for(call, timeout=self._connect_timeout)
+                return True
+            except (asyncio.TimeoutError, Exception):
+                self._device = None
+                if attempt:
+                    raise
+                logging.info("Tapo session lost, reconnecting...")
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self._refresh_interval)
+            try:
+                async with self._lock:
+                    if self._device is not None and hasattr(self._device, 'refresh_session'):
+                        await asyncio.wait_for(self._device.refresh_session(),
+                                               timeout=self._connect_timeout)
+                        self.connected_at = time.monotonic()
+                    else:
+                        await self._connect()
+            except (asyncio.TimeoutError, Exception) as e:
+                logging.error(f"Failed to refresh the Tapo session: {e}")
+                self._device = None
+
+
+class FakePlug:
+    """Stand-in for a P110 device handle. Records relay state and the time
+    of every switch so tap-to-relay latency can be measured offline."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.is_on = False
+        self.switch_times = []
+
+    async def _switch(self, state):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.is_on = state
+        self.switch_times.append(time.monotonic())
+
+    async def on(self):
+        await self._switch(True)
+
+    async def off(self):
+        await self._switch(False)
+
+    async def refresh_session(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class FakeApiClient:
+    """Stand-in for ``tapo.ApiClient`` that hands out one shared FakePlug
+    and counts logins."""
+
+    plug = FakePlug()
+    logins = 0
+
+    def __init__(self, username, password):
+        self._username = username
+
+    async def p110(self, ip_address):
+        FakeApiClient.logins += 1
+        if self.plug.latency:
+            await asyncio.sleep(self.plug.latency)
+        return self.plug
+
+
+class PlugController:
+    """Runs an on-time window for the plug as a background task so card
+    polling never waits on it. Activating again while the plug is on
+    extends the window instead of starting a second one."""
+
+    def __init__(self, switch, on_time):
+        # switch is a coroutine function taking turn_on and returning success
+        self._switch = switch
+        self.on_time = on_time
+        self._deadline = None
+        self._task = None
+
+    @property
+    def is_active(self):
+        return self._task is not None and not self._task.done()
+
+    def activate(self, on_result=None):
+        """Start a new on-time window or extend the running one. Returns
+        True if an existing window was extended. on_result is called with
+        the success and latency of the switch-on call of a new window."""
+        self._deadline = time.monotonic() + self.on_time
+        if self.is_active:
+            return True
+        self._task = asyncio.create_task(self._run(on_result))
+        return False
+
+    async def cancel(self):
+        """Stop the running window and turn the plug off right away."""
+        if not self.is_active:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self, on_result=None):
+        started = time.monotonic()
+        success = await self._switch(True)
+        if on_result is not None:
+            on_result(success, time.monotonic() - started)
+        if not success:
+            return
+        try:
+            while True:
+                remaining = self._deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(remaining)
+        finally:
+            await asyncio.shield(self._switch(False))
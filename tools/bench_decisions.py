@@ -0,0 +1,103 @@
+"""
+Microbenchmark of the scan decision path with a 10k entry whitelist.
+
+Compares the old path, which formatted every UID as hex and checked it
+against the master card list and a set of strings, with Whitelist.decide,
+a single dict lookup on the bytes UID. Also times loading the whitelist.
+
+    python tools/bench_decisions.py [--entries 10000] [--scans 100000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from whitelist import Whitelist  # noqa: E402
+
+
+def random_uid(rng):
+    # Mostly 4 byte UIDs, some 7 byte ones as on NTAG cards
+    return bytes(rng.getrandbits(8) for _ in range(rng.choice((4, 4, 4, 7))))
+
+
+def old_decide(uid, master_card_uids, whitelist):
+    # The scan loop before the change, with UIDs as hex strings
+    uid_hex = ''.join([hex(i)[2:].zfill(2) for i in uid])
+    if uid_hex in master_card_uids:
+        return 'master'
+    if uid_hex in whitelist:
+        return 'whitelisted'
+    return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--entries', type=int, default=10000)
+    parser.add_argument('--scans', type=int, default=100000)
+    parser.add_argument('--masters', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    uids = {random_uid(rng) for _ in range(args.entries)}
+    masters = [random_uid(rng) for _ in range(args.masters)]
+    # 90% whitelisted cards, 5% master cards, 5% unknown cards
+    pool = list(uids)
+    scans = []
+    for _ in range(args.scans):
+        roll = rng.random()
+        if roll < 0.9:
+            scans.append(rng.choice(pool))
+        elif roll < 0.95:
+            scans.append(rng.choice(masters))
+        else:
+            scans.append(random_uid(rng))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'whitelist.txt')
+        with open(path, 'w') as f:
+            f.writelines(f"{uid.hex()}\n" for uid in uids)
+
+        start = time.perf_counter()
+        whitelist = Whitelist(path, master_uids=masters)
+        load_time = time.perf_counter() - start
+
+        # The old setup: master UIDs as a list split from the config once at
+        # import, whitelist as a set of hex strings
+        master_card_uids = ','.join(uid.hex() for uid in masters).split(',')
+        string_whitelist = {uid.hex() for uid in uids}
+
+        def old_path():
+            for uid in scans:
+                old_decide(uid, master_card_uids, string_whitelist)
+
+        def new_path():
+            decide = whitelist.decide
+            for uid in scans:
+                decide(uid)
+
+        results = {}
+        for name, function in (('old', old_path), ('new', new_path)):
+            best = min(timeit.repeat(function, number=1, repeat=5))
+            results[name] = best / len(scans) * 1e9
+
+        mismatches = sum(old_decide(uid, master_card_uids, string_whitelist)
+                         != whitelist.decide(uid) for uid in scans)
+
+    print(f"whitelist entries:   {len(uids)}")
+    print(f"scans:               {len(scans)}")
+    print(f"load:                {load_time * 1000:.1f} ms")
+    print(f"old decision path:   {results['old']:.0f} ns per scan")
+    print(f"Whitelist.decide:    {results['new']:.0f} ns per scan")
+    print(f"speedup:             {results['old'] / results['new']:.1f}x")
+    print(f"mismatches:          {mismatches}")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Benchmark of the SPI framing of PN532_SPI against a fake spidev.
+
+Polls with InListPassiveTarget, which goes through call_function with its
+status reads, with the bus delays skipped, so only the host side work is
+measured. Compares the table driven framing with the original per byte bit
+reversal and reports microseconds and the peak memory allocated per call,
+the latter from tracemalloc. Both include the same share for the fake.
+
+    python tools/bench_spi.py [--calls 20000]
+"""
+
+import argparse
+import sys
+import time
+import tracemalloc
+import types
+
+from fakes import FakePN532, FakeSpiDev, install
+
+GPIO = install()
+
+from pn532 import PN532_SPI, TIMING_FAST  # noqa: E402  (needs the fakes installed)
+from pn532 import spi as spi_module  # noqa: E402
+
+CS = 8
+
+# Even time.sleep(0) is a system call, skip the bus delays altogether so
+# the numbers show the Python work per command
+spi_module.time = types.SimpleNamespace(sleep=lambda seconds: None, monotonic=time.monotonic)
+
+_STATREAD = 0x02
+_DATAWRITE = 0x01
+_DATAREAD = 0x03
+_READY = 0x01
+
+
+class LegacySPI(PN532_SPI):
+    """The framing as it was before the translation table: every byte goes
+    through reverse_bit, and the write path converts the frame to a list."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        spi = self._spi.spi
+        self._spi._writebytes = lambda buf: spi.writebytes(list(buf))
+
+    def _wait_ready(self, timeout=1):
+        reverse_bit = spi_module.reverse_bit
+        status = bytearray([reverse_bit(_STATREAD), 0])
+        timestamp = time.monotonic()
+        while (time.monotonic() - timestamp) < timeout:
+            status = self._spi.xfer(status)
+            if reverse_bit(status[1]) == _READY:
+                return True
+        return False
+
+    def _read_data(self, count):
+        reverse_bit = spi_module.reverse_bit
+        frame = bytearray(count+1)
+        frame[0] = reverse_bit(_DATAREAD)
+        frame = self._spi.xfer(frame)
+        for i, val in enumerate(frame):
+            frame[i] = reverse_bit(val)
+        return frame[1:]
+
+    def _write_data(self, framebytes):
+        reverse_bit = spi_module.reverse_bit
+        rev_frame = [reverse_bit(x) for x in bytes([_DATAWRITE]) + framebytes]
+        self._spi.writebytes(bytes(rev_frame))
+
+
+def make_reader(cls):
+    FakeSpiDev.chip = FakePN532(GPIO)
+    return cls(cs=CS, timing=TIMING_FAST)
+
+
+def measure(cls, calls):
+    pn532 = make_reader(cls)
+    poll = pn532.read_passive_target
+    for _ in range(100):    # warm up the frame caches
+        poll(timeout=0.5)
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        poll(timeout=0.5)
+    micros = (time.perf_counter() - start) / calls * 1e6
+
+    tracemalloc.start()
+    peaks = []
+    for _ in range(100):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        poll(timeout=0.5)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    uid = poll(timeout=0.5)
+    return micros, sorted(peaks)[len(peaks) // 2], uid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=20000)
+    args = parser.parse_args()
+
+    results = {}
+    for name, cls in (('original', LegacySPI), ('table driven', PN532_SPI)):
+        results[name] = measure(cls, args.calls)
+
+    print(f"{'framing':14} {'us/call':>8} {'peak bytes':>11}")
+    for name, (micros, peak, _) in results.items():
+        print(f"{name:14} {micros:8.1f} {peak:11d}")
+    # Both must still read the card the fake presents
+    uids = {bytes(result[2]) for result in results.values()}
+    if uids != {FakePN532(GPIO).uid}:
+        print(f"unexpected UIDs: {uids}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+Requests per second of the web UI under gunicorn with 3 workers, the way
+webui/README.md deploys it.
+
+Starts gunicorn on a local port with a generated whitelist and scan CSV in
+a temporary directory, then runs each scenario for a few seconds from
+several client threads: the index page and the CSV download, both in full
+and revalidated with If-None-Match, a resumed CSV download and a page of
+the whitelist API. Needs gunicorn and the web UI requirements installed.
+
+    python tools/bench_webui.py [--workers 3] [--clients 8] [--duration 5]
+"""
+
+import argparse
+import http.client
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+WEBUI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'webui')
+
+SETTINGS = """[Settings]
+csv_path = {directory}/card_scans.csv
+whitelist_path = {directory}/whitelist.txt
+service_name = coffee_nfc.service
+db_path = {directory}/card_scans.db
+control_socket = {directory}/control.sock
+log_source = fake
+"""
+
+
+def write_data(directory, cards, csv_rows):
+    rng = random.Random(1)
+    uids = [f'{rng.getrandbits(32):08x}' for _ in range(cards)]
+    with open(os.path.join(directory, 'whitelist.txt'), 'w') as f:
+        f.writelines(f'{uid}\n' for uid in uids)
+    with open(os.path.join(directory, 'card_scans.csv'), 'w') as f:
+        f.write('uid,count\n')
+        f.writelines(f'{rng.choice(uids)},{rng.randrange(1, 500)}\n' for _ in range(csv_rows))
+    with open(os.path.join(directory, 'webui.ini'), 'w') as f:
+        f.write(SETTINGS.format(directory=directory))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def request(port, path, headers=None):
+    """Make one request on a fresh connection, the sync workers close it
+    after every response anyway. Returns the status and the body size."""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        connection.request('GET', path, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, len(response.read()), response.getheader('ETag')
+    finally:
+        connection.close()
+
+
+def wait_until_up(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited, see its output above')
+        try:
+            request(port, '/')
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not come up')
+
+
+def run(port, path, headers, clients, duration):
+    """Hit path from clients threads for duration seconds. Returns the
+    requests per second, the statuses seen and the bytes per response."""
+    counts = [0] * clients
+    statuses = set()
+    sizes = set()
+    stop = time.monotonic() + duration
+
+    def client(index):
+        while time.monotonic() < stop:
+            status, size, _ = request(port, path, headers)
+            statuses.add(status)
+            sizes.add(size)
+            counts[index] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / (time.monotonic() - start), sorted(statuses), max(sizes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--cards', type=int, default=10000)
+    parser.add_argument('--csv-rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_data(directory, args.cards, args.csv_rows)
+        port = free_port()
+        # Run from the data directory, where the app finds webui.ini
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--workers', str(args.workers),
+             '--bind', f'127.0.0.1:{port}', '--pythonpath', WEBUI, 'wsgi:app'],
+            cwd=directory)
+        try:
+            wait_until_up(port, process)
+            _, _, index_etag = request(port, '/')
+            _, _, csv_etag = request(port, '/download-csv', {'Accept-Encoding': 'gzip'})
+            scenarios = [
+                ('index', '/', {}),
+                ('index, 304', '/', {'If-None-Match': index_etag}),
+                ('csv, gzip', '/download-csv', {'Accept-Encoding': 'gzip'}),
+                ('csv, gzip, 304', '/download-csv',
+                 {'Accept-Encoding': 'gzip', 'If-None-Match': csv_etag}),
+                ('csv, range', '/download-csv', {'Range': 'bytes=1000000-'}),
+                ('whitelist api', '/api/whitelist?prefix=a&limit=100', {}),
+            ]
+            print(f'gunicorn with {args.workers} workers, {args.clients} clients, '
+                  f'{args.cards} cards, {args.csv_rows} CSV rows')
+            print(f"{'scenario':16} {'req/s':>8} {'status':>10} {'bytes':>9}")
+            for name, path, headers in scenarios:
+                rate, statuses, size = run(port, path, headers, args.clients, args.duration)
+                print(f"{name:16} {rate:8.1f} {','.join(map(str, statuses)):>10} {size:9d}")
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
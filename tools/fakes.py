@@ -0,0 +1,335 @@
+"""
+Stand-ins for RPi.GPIO, spidev and serial, so the scripts in this directory
+run on any machine. Call install() before importing pn532.
+
+FakePN532 answers commands like the chip does: an ACK first, then the
+response frame, each one signalled on the IRQ pin once it is ready.
+PtyPN532 does the same on the far end of a pseudo terminal, which
+FakeSerial opens in place of the UART.
+"""
+
+import fcntl
+import os
+import pty
+import select
+import struct
+import sys
+import termios
+import threading
+import time
+import tty
+import types
+from collections import deque
+
+# Make the repo root importable when a script is run as tools/<name>.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+ACK = b'\x00\x00\xff\x00\xff\x00'
+SPI_STATREAD = 0x02
+SPI_DATAWRITE = 0x01
+SPI_DATAREAD = 0x03
+
+
+_REVERSED = bytes(int(f'{b:08b}'[::-1], 2) for b in range(256))
+
+
+def reverse_bits(data):
+    return bytes(data).translate(_REVERSED)
+
+
+def build_frame(data):
+    """PN532 information frame around data, as the chip sends it."""
+    length = len(data)
+    checksum = (-sum(data)) & 0xFF
+    return bytes([0x00, 0x00, 0xFF, length, (-length) & 0xFF]) + bytes(data) + bytes([checksum, 0x00])
+
+
+def build_extended_frame(data):
+    """The same as build_frame, as an extended frame with a 16 bit length."""
+    length = len(data).to_bytes(2, 'big')
+    checksum = (-sum(data)) & 0xFF
+    return (bytes([0x00, 0x00, 0xFF, 0xFF, 0xFF]) + length + bytes([(-sum(length)) & 0xFF])
+            + bytes(data) + bytes([checksum, 0x00]))
+
+
+def answer(command, uid):
+    """Response data of the fake PN532 to a command, after D5 and the
+    response code."""
+    if command == 0x02:         # GetFirmwareVersion
+        return b'\x32\x01\x06\x07'
+    if command == 0x4A:         # InListPassiveTarget, one ISO14443A card
+        return bytes([0x01, 0x01, 0x00, 0x04, 0x08, len(uid)]) + uid
+    if command == 0x16:         # PowerDown
+        return b'\x00'
+    return b''
+
+
+def parse_frame(frame):
+    """Return the data of a host frame, skipping the preamble."""
+    offset = frame.index(b'\x00\xff') + 2
+    length = frame[offset]
+    return frame[offset+2:offset+2+length]
+
+
+class FakeGPIO(types.ModuleType):
+    """Enough of RPi.GPIO for the pn532 transports. Pin levels are kept in a
+    dict, and set_level runs the edge callbacks like the GPIO event thread."""
+
+    BCM = 11
+    IN = 1
+    OUT = 0
+    LOW = 0
+    HIGH = 1
+    FALLING = 32
+    RISING = 31
+
+    def __init__(self):
+        super().__init__('RPi.GPIO')
+        self.levels = {}
+        self.callbacks = {}
+        self.edge_detection = True
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction, **kwargs):
+        self.levels.setdefault(pin, self.HIGH)
+
+    def output(self, pin, value):
+        self.levels[pin] = int(bool(value))
+
+    def input(self, pin):
+        return self.levels.get(pin, self.HIGH)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        if not self.edge_detection:
+            raise RuntimeError('Failed to add edge detection')
+        self.callbacks[pin] = callback
+
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(pin, None)
+
+    def cleanup(self, *args):
+        self.levels.clear()
+        self.callbacks.clear()
+
+    def set_level(self, pin, level):
+        """Drive an input pin, running its callback on a falling edge."""
+        previous = self.levels.get(pin, self.HIGH)
+        self.levels[pin] = level
+        callback = self.callbacks.get(pin)
+        if callback is not None and previous == self.HIGH and level == self.LOW:
+            callback(pin)
+
+
+class FakePN532:
+    """Queues an ACK and a response frame for every command it receives.
+    The ACK is ready at once and the response after `response_delay`
+    seconds. While a frame is ready the IRQ pin is low, and reading the
+    frame releases it."""
+
+    def __init__(self, gpio, irq=None, uid=b'\x04\x11\x22\x33', response_delay=0):
+        self.gpio = gpio
+        self.irq = irq
+        self.uid = uid
+        self.response_delay = response_delay
+        self.commands = 0
+        self._frames = deque()      # (delay, frame) not signalled yet
+        self._ready = None          # frame the host may read now
+        self._lock = threading.RLock()
+        self._timer = None
+
+    def response(self, command):
+        return answer(command, self.uid)
+
+    def receive(self, data):
+        """Take the data of a host frame and queue the answers to it."""
+        command = data[1]
+        self.commands += 1
+        with self._lock:
+            self._frames.append((0, ACK))
+            self._frames.append((self.response_delay,
+                                 build_frame(bytes([0xD5, command + 1]) + self.response(command))))
+            self._advance()
+
+    def is_ready(self):
+        return self._ready is not None
+
+    def read(self, count):
+        """Hand out the ready frame, padded or cut to count bytes."""
+        with self._lock:
+            frame, self._ready = self._ready or b'', None
+            if self.irq is not None:
+                self.gpio.set_level(self.irq, self.gpio.HIGH)
+            self._advance()
+        return (frame + bytes(count))[:count]
+
+    def _advance(self):
+        if self._ready is not None or self._timer is not None or not self._frames:
+            return
+        delay, frame = self._frames[0]
+        if delay <= 0:
+            self._signal()
+        else:
+            self._timer = threading.Timer(delay, self._signal)
+            self._timer.start()
+
+    def _signal(self):
+        with self._lock:
+            self._timer = None
+            _, self._ready = self._frames.popleft()
+            if self.irq is not None:
+                self.gpio.set_level(self.irq, self.gpio.LOW)
+
+
+class FakeSpiDev:
+    """spidev.SpiDev wired to a FakePN532, with the bits of every byte
+    reversed on the wire as the PN532 sends and expects them."""
+
+    chip = None     # FakePN532 of the next SpiDev created
+
+    def __init__(self, bus=0, device=0):
+        self.chip = FakeSpiDev.chip
+        self.max_speed_hz = 0
+        self.mode = 0
+        self.status_reads = 0
+
+    def writebytes(self, data):
+        data = reverse_bits(data)
+        if data[0] == SPI_DATAWRITE:
+            self.chip.receive(parse_frame(data[1:]))
+
+    writebytes2 = writebytes
+
+    def readbytes(self, count):
+        return list(reverse_bits(self.chip.read(count)))
+
+    def xfer(self, data):
+        command = reverse_bits(data[:1])[0]
+        if command == SPI_STATREAD:
+            self.status_reads += 1
+            return [0, reverse_bits([0x01 if self.chip.is_ready() else 0x00])[0]]
+        if command == SPI_DATAREAD:
+            return [0] + list(reverse_bits(self.chip.read(len(data) - 1)))
+        return [0] * len(data)
+
+
+class PtyPN532:
+    """PN532 on the master end of a pseudo terminal, whose slave end is
+    `port`. Every host frame is answered with an ACK and, `response_delay`
+    seconds later, the response frame. To exercise the host side decoder,
+    every frame can be sent in `chunks` separate writes, responses can be
+    preceded by `garbage` and sent as extended frames."""
+
+    def __init__(self, uid=b'\x04\x11\x22\x33', response_delay=0, chunks=1,
+                 chunk_gap=0.002, garbage=b'', extended=False):
+        self.uid = uid
+        self.response_delay = response_delay
+        self.chunks = chunks
+        self.chunk_gap = chunk_gap
+        self.garbage = garbage
+        self.extended = extended
+        self.commands = 0
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._closed = True
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _run(self):
+        buf = bytearray()
+        while not self._closed:
+            if not select.select([self._master], [], [], 0.05)[0]:
+                continue
+            buf += os.read(self._master, 1024)
+            while True:
+                start = buf.find(b'\x00\xff')
+                if start < 0 or len(buf) < start + 4:
+                    break
+                length = buf[start+2]
+                end = start + 4 + length + 2
+                if len(buf) < end:
+                    break
+                data = bytes(buf[start+4:start+4+length])
+                del buf[:end]
+                self._respond(data)
+
+    def _respond(self, data):
+        command = data[1]
+        self.commands += 1
+        self._send(ACK)
+        time.sleep(self.response_delay)
+        response = bytes([0xD5, command + 1]) + answer(command, self.uid)
+        frame = build_extended_frame(response) if self.extended else build_frame(response)
+        self._send(self.garbage + frame)
+
+    def _send(self, frame):
+        size = -(-len(frame) // self.chunks)
+        for offset in range(0, len(frame), size):
+            if offset:
+                time.sleep(self.chunk_gap)
+            os.write(self._master, frame[offset:offset+size])
+
+
+class FakeSerial:
+    """serial.Serial on a pseudo terminal, with what PN532_UART uses."""
+
+    def __init__(self, port, baudrate=9600):
+        self._fd = os.open(port, os.O_RDWR | os.O_NOCTTY)
+        tty.setraw(self._fd)
+        self.is_open = True
+
+    @property
+    def in_waiting(self):
+        return struct.unpack('i', fcntl.ioctl(self._fd, termios.FIONREAD, b'\0\0\0\0'))[0]
+
+    def read(self, size=1):
+        # Blocks until size bytes are in, like pyserial without a timeout
+        data = bytearray()
+        while len(data) < size:
+            data += os.read(self._fd, size - len(data))
+        return bytes(data)
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view):]
+        return len(data)
+
+    def fileno(self):
+        return self._fd
+
+    def reset_input_buffer(self):
+        termios.tcflush(self._fd, termios.TCIFLUSH)
+
+    def close(self):
+        if self.is_open:
+            os.close(self._fd)
+            self.is_open = False
+
+
+def install():
+    """Register the fakes as RPi.GPIO, spidev and serial and return the
+    fake GPIO module."""
+    gpio = FakeGPIO()
+    rpi = types.ModuleType('RPi')
+    rpi.GPIO = gpio
+    spidev = types.ModuleType('spidev')
+    spidev.SpiDev = FakeSpiDev
+    serial = types.ModuleType('serial')
+    serial.Serial = FakeSerial
+    sys.modules.update({'RPi': rpi, 'RPi.GPIO': gpio, 'spidev': spidev, 'serial': serial})
+    return gpio
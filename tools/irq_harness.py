@@ -0,0 +1,118 @@
+"""
+Simulated IRQ harness for the interrupt driven ready wait of the PN532
+transports. Runs PN532_SPI against a fake PN532 that drives the IRQ pin and
+checks the races _wait_irq has to get right:
+
+- the edge fires before the wait starts, while the command is still being
+  written, and only the level of the line tells that a frame is ready
+- the edge fires while waiting
+- an edge left over from an earlier frame must not end the next wait
+- no edge at all times out
+- without edge detection the status polling is used instead
+
+    python tools/irq_harness.py
+"""
+
+import sys
+import time
+
+from fakes import FakePN532, FakeSpiDev, install
+
+GPIO = install()
+
+from pn532 import PN532_SPI, TIMING_FAST  # noqa: E402  (needs the fakes installed)
+
+CS = 8
+IRQ = 25
+
+
+def make_reader(response_delay=0, edge_detection=True):
+    GPIO.edge_detection = edge_detection
+    chip = FakePN532(GPIO, irq=IRQ, response_delay=response_delay)
+    FakeSpiDev.chip = chip
+    pn532 = PN532_SPI(cs=CS, irq=IRQ, timing=TIMING_FAST)
+    return pn532, chip
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def edge_before_wait():
+    # The fake answers synchronously, so the edge comes while the command
+    # is written and before _wait_irq clears the event
+    pn532, _ = make_reader()
+    version, _ = timed(pn532.get_firmware_version)
+    return version == (0x32, 0x01, 0x06, 0x07), f'version {version}'
+
+
+def edge_during_wait():
+    pn532, chip = make_reader()
+    chip.response_delay = 0.05
+    version, elapsed = timed(pn532.get_firmware_version)
+    # Woken by the edge, not by a poll interval or the 0.5 s timeout
+    ok = version is not None and 0.05 <= elapsed < 0.07
+    return ok, f'answered after {elapsed * 1000:.1f} ms for a 50 ms response'
+
+
+def level_without_edge():
+    # Line already low and the event cleared: only the level check finds it
+    pn532, _ = make_reader()
+    GPIO.levels[IRQ] = GPIO.LOW
+    ready, elapsed = timed(pn532._wait_irq, 0.2)
+    GPIO.levels[IRQ] = GPIO.HIGH
+    return ready and elapsed < 0.01, f'ready={ready} after {elapsed * 1000:.1f} ms'
+
+
+def stale_edge():
+    # The event is still set from a frame that has been read since
+    pn532, _ = make_reader()
+    pn532._irq_ready.set()
+    ready, elapsed = timed(pn532._wait_irq, 0.1)
+    return not ready and elapsed >= 0.1, f'ready={ready} after {elapsed * 1000:.1f} ms'
+
+
+def timeout():
+    pn532, chip = make_reader()
+    chip.response_delay = 10
+    version, elapsed = timed(pn532.call_function, 0x02, 4, None, 0.1)
+    return version is None and elapsed < 0.2, f'result {version} after {elapsed * 1000:.1f} ms'
+
+
+def no_status_polling():
+    pn532, _ = make_reader()
+    polls = pn532._spi.spi.status_reads
+    for _ in range(100):
+        pn532.read_passive_target(timeout=0.5)
+    polls = pn532._spi.spi.status_reads - polls
+    return polls == 0, f'{polls} status reads for 100 polls'
+
+
+def polling_fallback():
+    pn532, _ = make_reader(edge_detection=False)
+    uid = pn532.read_passive_target(timeout=0.5)
+    polls = pn532._spi.spi.status_reads
+    ok = pn532._irq_ready is None and uid == b'\x04\x11\x22\x33' and polls > 0
+    return ok, f'uid {uid.hex() if uid else None}, {polls} status reads'
+
+
+CASES = [edge_before_wait, edge_during_wait, level_without_edge, stale_edge, timeout,
+         no_status_polling, polling_fallback]
+
+
+def main():
+    failed = 0
+    for case in CASES:
+        try:
+            ok, detail = case()
+        except Exception as e:
+            ok, detail = False, f'{type(e).__name__}: {e}'
+        failed += not ok
+        print(f"{'PASS' if ok else 'FAIL'}  {case.__name__:20} {detail}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+Harness for the LED signaller on a fake sysfs directory.
+
+Builds a temporary <led>/trigger and <led>/brightness tree for the PWR and
+ACT LEDs and checks that play() returns at once and the event loop keeps
+running while a pattern plays, that a higher priority pattern preempts a
+lower one while a lower one cannot preempt it, and that each LED gets its
+trigger back once the last pattern is done. Pattern durations are scaled
+down so the run takes about a second.
+
+    python tools/led_harness.py
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import leds  # noqa: E402
+
+SCALE = 0.1
+
+
+def build_tree(base_path):
+    for name, trigger in leds.DEFAULT_TRIGGERS.items():
+        os.makedirs(os.path.join(base_path, name))
+        write(base_path, name, 'trigger', trigger)
+        write(base_path, name, 'brightness', '1' if trigger == 'default-on' else '0')
+
+
+def write(base_path, name, attribute, value):
+    with open(os.path.join(base_path, name, attribute), 'w') as f:
+        f.write(value)
+
+
+def read(base_path, name, attribute):
+    # Led writes in place without truncating, as sysfs needs no truncation,
+    # so a shorter value leaves the tail of the longer one behind
+    with open(os.path.join(base_path, name, attribute)) as f:
+        return f.read()
+
+
+async def check(base_path):
+    results = []
+    signaller = leds.LedSignaller(base_path)
+
+    # The event loop must keep running while a long pattern plays
+    gaps = []
+
+    async def ticker(stop):
+        last = time.perf_counter()
+        while not stop.is_set():
+            await asyncio.sleep(0.005)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    stop = asyncio.Event()
+    tick_task = asyncio.create_task(ticker(stop))
+    start = time.perf_counter()
+    signaller.play('heartbeat')
+    elapsed = time.perf_counter() - start
+    results.append(('play returns at once', elapsed < 0.005, f'{elapsed * 1e6:.0f} us'))
+
+    # master outranks heartbeat, unknown does not outrank master
+    await asyncio.sleep(0.01)
+    heartbeat = signaller._playing['PWR'][1]
+    signaller.play('master')
+    await asyncio.sleep(0.01)
+    master = signaller._playing['PWR'][1]
+    signaller.play('unknown')
+    await asyncio.sleep(0.01)
+    playing = signaller._playing['PWR'][0]
+    results.append(('higher priority preempts', heartbeat.cancelled() and not master.done(),
+                    f'heartbeat cancelled={heartbeat.cancelled()}'))
+    results.append(('lower priority does not preempt', playing is leds.PATTERNS['master'],
+                    f'playing {playing}'))
+    # The cancelled heartbeat must not hand the LED back in the middle of master
+    trigger = read(base_path, 'PWR', 'trigger')
+    results.append(('preempted pattern keeps off the LED', trigger.startswith('none'),
+                    f'trigger {trigger!r} while master plays'))
+
+    signaller.play('whitelisted')
+    await asyncio.gather(master, signaller._playing['ACT'][1], return_exceptions=True)
+    stop.set()
+    await tick_task
+    worst = max(gaps)
+    results.append(('event loop keeps running', worst < 0.05, f'longest tick {worst * 1000:.1f} ms'))
+
+    for name, trigger in leds.DEFAULT_TRIGGERS.items():
+        restored = read(base_path, name, 'trigger')
+        brightness = read(base_path, name, 'brightness')
+        results.append((f'{name} trigger restored', restored == trigger and brightness == '0',
+                        f'trigger {restored!r}, brightness {brightness!r}'))
+    signaller.close()
+    return results
+
+
+def main():
+    for name, pattern in leds.PATTERNS.items():
+        leds.PATTERNS[name] = pattern._replace(duration=pattern.duration * SCALE)
+    with tempfile.TemporaryDirectory() as base_path:
+        build_tree(base_path)
+        results = asyncio.run(check(base_path))
+    failed = 0
+    for name, ok, detail in results:
+        failed += not ok
+        print(f"{'PASS' if ok else 'FAIL'}  {name:36} {detail}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
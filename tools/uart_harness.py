@@ -0,0 +1,108 @@
+"""
+Loopback harness for PN532_UART on a pseudo terminal.
+
+A fake PN532 on the far end of the pty answers every command. The frame
+decoder has to cope with frames that arrive in pieces, garbage before a
+frame, ACKs and extended frames, and each case is checked with a run of
+GetFirmwareVersion and InListPassiveTarget commands. Then the command
+latency is compared with the original driver, which polled the UART every
+50 ms and read whatever was buffered.
+
+    python tools/uart_harness.py [--commands 50] [--response-delay 0.005]
+"""
+
+import argparse
+import sys
+import time
+
+from fakes import PtyPN532, install
+
+install()
+
+from pn532 import PN532_UART, TIMING_FAST  # noqa: E402  (needs the fakes installed)
+from pn532.pn532 import BusyError  # noqa: E402
+
+UID = b'\x04\x11\x22\x33'
+
+SCENARIOS = [
+    ('clean', {}),
+    ('split', {'chunks': 4}),
+    ('garbage', {'garbage': b'\xaa\x00\x13\x00\x00\xff\x05'}),
+    ('extended', {'extended': True}),
+    ('all of them', {'chunks': 3, 'garbage': b'\x00\x42\xff', 'extended': True}),
+]
+
+
+class LegacyUART(PN532_UART):
+    """The UART driver as it was before the frame decoder."""
+
+    def _wait_ready(self, timeout=0.001):
+        timestamp = time.monotonic()
+        while (time.monotonic() - timestamp) < timeout:
+            if self._uart.in_waiting:
+                return True
+            time.sleep(0.05)
+        return False
+
+    def _read_data(self, count):
+        frame = self._uart.read(min(self._uart.in_waiting, count))
+        if not frame:
+            raise BusyError("No data read from PN532")
+        time.sleep(0.005)
+        return frame
+
+    def _write_data(self, framebytes):
+        self._uart.read(self._uart.in_waiting)
+        self._uart.write(framebytes)
+
+
+def run_commands(cls, chip, commands):
+    """Run commands pairs of GetFirmwareVersion and InListPassiveTarget.
+    Returns the number of correct answers and the mean latency."""
+    pn532 = cls(dev=chip.port, timing=TIMING_FAST)
+    correct = 0
+    start = time.perf_counter()
+    try:
+        for _ in range(commands):
+            correct += pn532.get_firmware_version() == (0x32, 0x01, 0x06, 0x07)
+            correct += pn532.read_passive_target(timeout=1) == UID
+    finally:
+        pn532._uart.close()
+    return correct, (time.perf_counter() - start) / (2 * commands)
+
+
+def attempt(cls, scenario, commands, response_delay):
+    chip = PtyPN532(uid=UID, response_delay=response_delay, **scenario)
+    try:
+        return run_commands(cls, chip, commands) + (None,)
+    except Exception as e:
+        return 0, None, f'{type(e).__name__}: {e}'
+    finally:
+        chip.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--commands', type=int, default=50)
+    parser.add_argument('--response-delay', type=float, default=0.005,
+                        help='seconds the fake PN532 takes to answer')
+    args = parser.parse_args()
+
+    failed = 0
+    print(f"{'scenario':12} {'decoder':>16} {'original 50 ms poll':>22}")
+    for name, scenario in SCENARIOS:
+        columns = []
+        for cls in (PN532_UART, LegacyUART):
+            correct, latency, error = attempt(cls, scenario, args.commands, args.response_delay)
+            if error is not None:
+                columns.append(f"fails, {error.split(':')[0]}")
+            else:
+                columns.append(f'{correct}/{2 * args.commands} {latency * 1000:6.1f} ms')
+            if cls is PN532_UART:
+                failed += error is not None or correct != 2 * args.commands
+        print(f"{name:12} {columns[0]:>16} {columns[1]:>22}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,18 @@
-from flask import Flask, request, send_file, render_template, redirect, url_for
-from flask_socketio import SocketIO
+from flask import Flask, request, send_file, render_template, redirect, url_for, make_response, jsonify
+from flask_socketio import SocketIO, join_room
+from collections import deque
+from datetime import datetime, timedelta
 import configparser
+import contextlib
+import bisect
+import fcntl
+import hashlib
 import os
+import sqlite3
 import subprocess
 import threading
+import zlib
+from control_client import ControlClient, ControlError, VERSION_CONFLICT
 
 app = Flask(__name__)
 socketio = SocketIO(app)
@@ -14,46 +23,472 @@ config.read('webui.ini')
 CSV_PATH = config['Settings']['csv_path']
 WHITELIST_PATH = config['Settings']['whitelist_path']
 SERVICE_NAME = config['Settings']['service_name']
+# Shared with the reader service, see whitelist.py
+WHITELIST_JOURNAL_PATH = WHITELIST_PATH + '.journal'
+WHITELIST_LOCK_PATH = WHITELIST_PATH + '.lock'
+# 'journal' tails the service, 'fake' generates lines for load testing
+LOG_SOURCE = config['Settings'].get('log_source', 'journal')
+LOG_BACKLOG = config['Settings'].getint('log_backlog', 200)
+FAKE_LOG_RATE = config['Settings'].getfloat('fake_log_rate', 50)
+# Socket.IO room of all clients on the logs page
+LOG_ROOM = 'logs'
+# Scan database of the reader service, next to the CSV by default
+DB_PATH = config['Settings'].get(
+    'db_path', os.path.join(os.path.dirname(CSV_PATH), 'card_scans.db'))
+# Rollup buckets shown on the dashboard: label format as in event_store.py,
+# number of buckets and length of one bucket
+DASHBOARD_PERIODS = [
+    ('hour', '%Y-%m-%d %H:00', 24, timedelta(hours=1)),
+    ('day', '%Y-%m-%d', 14, timedelta(days=1)),
+    ('week', '%G-W%V', 12, timedelta(weeks=1)),
+]
+DASHBOARD_TOP_USERS = 10
+# Control socket of the reader service, next to the whitelist by default
+CONTROL_SOCKET = config['Settings'].get(
+    'control_socket', os.path.join(os.path.dirname(WHITELIST_PATH), 'control.sock'))
+# CSV downloads smaller than this are not worth compressing
+GZIP_MIN_SIZE = 1024
+GZIP_CHUNK_SIZE = 64 * 1024
+
+# Largest page returned by the whitelist API
+WHITELIST_PAGE_LIMIT = 500
+HEX_DIGITS = '0123456789abcdef'
+
+# (signature, content) of the whitelist and (signature, version, sorted
+# UIDs) of its index, where signature is whitelist_signature() when they
+# were read, and (version, html, etag) of the index page. Each gunicorn
+# worker keeps its own copy.
+whitelist_cache = {}
+uid_index_cache = {}
+index_cache = {}
+
+@contextlib.contextmanager
+def whitelist_lock(operation=fcntl.LOCK_EX):
+    fd = os.open(WHITELIST_LOCK_PATH, os.O_RDONLY | os.O_CREAT, 0o664)
+    try:
+        fcntl.flock(fd, operation)
+        yield
+    finally:
+        os.close(fd)
+
+def file_signature(*paths):
+    """mtime, size and inode of each path, None for missing files."""
+    signature = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            signature.append(None)
+            continue
+        signature.append((st.st_mtime_ns, st.st_size, st.st_ino))
+    return tuple(signature)
+
+def whitelist_signature():
+    return file_signature(WHITELIST_PATH, WHITELIST_JOURNAL_PATH)
+
+def cached_whitelist():
+    """Return the signature and the content of the whitelist with pending
+    journal entries applied. The content is cached until either file
+    changes."""
+    with whitelist_lock(fcntl.LOCK_SH):
+        signature = whitelist_signature()
+        entry = whitelist_cache.get('entry')
+        if entry is None or entry[0] != signature:
+            entry = whitelist_cache['entry'] = (signature, _read_whitelist())
+    return entry
+
+def _read_whitelist():
+    # Caller holds the whitelist lock
+    with open(WHITELIST_PATH, 'r') as file:
+        content = file.read()
+    if not os.path.exists(WHITELIST_JOURNAL_PATH):
+        return content
+    # The service journals lower case hex
+    uids = [uid for uid in (line.strip().lower() for line in content.splitlines()) if uid]
+    with open(WHITELIST_JOURNAL_PATH, 'r') as file:
+        for line in file:
+            if not line.endswith('\n'):
+                # Torn last line after a crash, the service ignores it too
+                break
+            line = line.strip().lower()
+            if line[:1] == '+' and line[1:] not in uids:
+                uids.append(line[1:])
+            elif line[:1] == '-' and line[1:] in uids:
+                uids.remove(line[1:])
+    return ''.join(f"{uid}\n" for uid in uids)
+
+def whitelist_version(signature):
+    """Short opaque version string, changes with every write to the files.
+    The service derives its versions the same way, see whitelist.py."""
+    return hashlib.sha1(repr(signature).encode()).hexdigest()[:16]
+
+def normalize_uid(uid):
+    """Return uid as lower case hex, or None if it is not a hex UID."""
+    try:
+        return bytes.fromhex(uid).hex() or None
+    except (TypeError, ValueError):
+        return None
+
+def uid_index():
+    """Return the whitelist version and the sorted list of its UIDs, which
+    serves prefix searches with bisect."""
+    signature, content = cached_whitelist()
+    entry = uid_index_cache.get('entry')
+    if entry is None or entry[0] != signature:
+        uids = sorted({uid for uid in map(normalize_uid, content.split()) if uid})
+        entry = uid_index_cache['entry'] = (signature, whitelist_version(signature), uids)
+    return entry[1], entry[2]
+
+def search_uids(uids, prefix):
+    """Return the range of the sorted uids that start with prefix."""
+    start = bisect.bisect_left(uids, prefix)
+    if not prefix:
+        return start, len(uids)
+    end = bisect.bisect_left(uids, prefix[:-1] + chr(ord(prefix[-1]) + 1), start)
+    return start, end
+
+def revalidated(response, etag, last_modified=None):
+    """Let clients cache response but check back every time, and answer 304
+    if their copy is still current."""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 @app.route('/')
 def index():
-    with open(WHITELIST_PATH, 'r') as file:
-        whitelist_content = file.read()
-    return render_template('index.html', whitelist_content=whitelist_content)
+    version, uids = uid_index()
+    entry = index_cache.get('entry')
+    if entry is None or entry[0] != version:
+        html = render_template('index.html', whitelist_size=len(uids))
+        entry = index_cache['entry'] = (version, html, hashlib.sha1(html.encode()).hexdigest())
+    return revalidated(make_response(entry[1]), entry[2])
+
+control = ControlClient(CONTROL_SOCKET)
+# Rebuilding the rollups reads the whole scan history
+rebuild_control = ControlClient(CONTROL_SOCKET, timeout=120)
+
+def control_action(method, **params):
+    """Call the service and go back to the index, or report that it failed."""
+    try:
+        control.call_sync(method, **params)
+    except ControlError as e:
+        return f'Service request failed: {e}', 503
+    return redirect(url_for('index'))
 
 @app.route('/restart-service', methods=['POST'])
 def restart_service():
     subprocess.run(['sudo', 'systemctl', 'restart', SERVICE_NAME])
     return redirect(url_for('index'))
 
+@app.route('/service-state')
+def service_state():
+    try:
+        return jsonify(state=control.call_sync('state'))
+    except ControlError as e:
+        return jsonify(error=str(e)), 503
+
+@app.route('/trigger-plug', methods=['POST'])
+def trigger_plug():
+    return control_action('trigger_plug')
+
+@app.route('/reload-config', methods=['POST'])
+def reload_config():
+    return control_action('reload_config')
+
+@app.route('/add-card', methods=['POST'])
+def add_card():
+    return control_action('change_whitelist', add=[request.form['uid'].strip().lower()])
+
+@app.route('/remove-card', methods=['POST'])
+def remove_card():
+    return control_action('change_whitelist', remove=[request.form['uid'].strip().lower()])
+
+def gzip_chunks(file):
+    compressor = zlib.compressobj(wbits=31)   # 31: gzip header and trailer
+    with file:
+        for chunk in iter(lambda: file.read(GZIP_CHUNK_SIZE), b''):
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+    yield compressor.flush()
+
 @app.route('/download-csv')
 def download_csv():
-    return send_file(CSV_PATH, as_attachment=True)
+    # Range requests get the plain file, whose ETag and ranges send_file handles
+    if request.range is None and 'gzip' in request.accept_encodings:
+        # Open first so the ETag describes the file that is actually sent
+        file = open(CSV_PATH, 'rb')
+        st = os.fstat(file.fileno())
+        if st.st_size >= GZIP_MIN_SIZE:
+            response = app.response_class(gzip_chunks(file), mimetype='text/csv')
+            # Otherwise make_conditional buffers the whole body to work out
+            # its length, even for a 304
+            response.implicit_sequence_conversion = False
+            response.call_on_close(file.close)
+            response.headers['Content-Encoding'] = 'gzip'
+            response.headers['Content-Disposition'] = (
+                f'attachment; filename={os.path.basename(CSV_PATH)}')
+            response.vary.add('Accept-Encoding')
+            return revalidated(response, f'{st.st_mtime_ns:x}-{st.st_size:x}-gzip',
+                               st.st_mtime)
+        file.close()
+    response = send_file(CSV_PATH, as_attachment=True, conditional=True, etag=True, max_age=0)
+    response.vary.add('Accept-Encoding')
+    return response
 
-@app.route('/update-whitelist', methods=['POST'])
-def update_whitelist():
-    new_content = request.form['whitelist_content']
-    with open(WHITELIST_PATH, 'w') as file:
-        file.write(new_content)
-    return redirect(url_for('index'))
+def dashboard_data(db):
+    """Read the dashboard from the rollup tables. Every query is bounded by
+    the number of buckets shown, not by the length of the history."""
+    now = datetime.now()
+    periods = {}
+    counts = {}
+    for period, label, count, length in DASHBOARD_PERIODS:
+        counts[period] = count
+        oldest = (now - length * (count - 1)).strftime(label)
+        periods[period] = [dict(zip(
+            ('bucket', 'coffees', 'scans', 'tapo_calls', 'tapo_failures', 'latency_sum', 'latency_max'),
+            row)) for row in db.execute(
+                "SELECT bucket, SUM(CASE WHEN decision = 'whitelisted' THEN scans ELSE 0 END), "
+                "SUM(scans), SUM(tapo_calls), SUM(tapo_failures), SUM(latency_sum), MAX(latency_max) "
+                "FROM rollup_periods WHERE period = ? AND bucket >= ? "
+                "GROUP BY bucket ORDER BY bucket DESC", (period, oldest))]
+    top_users = [dict(zip(('uid', 'coffees', 'scans', 'last_seen'), row)) for row in db.execute(
+        'SELECT uid, coffees, scans, last_ts FROM rollup_users ORDER BY coffees DESC LIMIT ?',
+        (DASHBOARD_TOP_USERS,))]
+    for user in top_users:
+        user['last_seen'] = datetime.fromtimestamp(user['last_seen']).strftime('%Y-%m-%d %H:%M')
+    # Plug statistics over the days shown
+    days = periods['day']
+    calls = sum(day['tapo_calls'] for day in days)
+    failures = sum(day['tapo_failures'] for day in days)
+    plug = {
+        'days': counts['day'],
+        'calls': calls,
+        'failure_rate': failures / calls if calls else 0,
+        'latency_avg': sum(day['latency_sum'] for day in days) / calls if calls else None,
+        'latency_max': max((day['latency_max'] for day in days if day['latency_max'] is not None),
+                           default=None),
+    }
+    return periods, top_users, plug
+
+@app.route('/dashboard')
+def dashboard():
+    try:
+        db = sqlite3.connect(f'file:{DB_PATH}?mode=ro', uri=True)
+        try:
+            periods, top_users, plug = dashboard_data(db)
+        finally:
+            db.close()
+    except sqlite3.Error as e:
+        return f'Scan database not available: {e}', 503
+    return render_template('dashboard.html', periods=periods, top_users=top_users, plug=plug)
+
+@app.route('/rebuild-rollups', methods=['POST'])
+def rebuild_rollups():
+    try:
+        rebuild_control.call_sync('rebuild_rollups')
+    except ControlError as e:
+        return f'Service request failed: {e}', 503
+    return redirect(url_for('dashboard'))
+
+@app.route('/whitelist')
+def whitelist_page():
+    return render_template('whitelist.html', page_size=100)
+
+def api_error(message, status, **fields):
+    return jsonify(error=message, **fields), status
+
+def apply_whitelist_change(**change):
+    """Have the service apply a change, on the condition that the whitelist
+    is still at one of the versions in the If-Match header. Without the
+    header or with `*` the change is made unconditionally. Weak tags never
+    match, versions are strong validators."""
+    if request.if_match and not request.if_match.star_tag:
+        change['expected_versions'] = sorted(request.if_match.as_set())
+    try:
+        version = control.call_sync('change_whitelist', **change)['version']
+    except ControlError as e:
+        if e.code == VERSION_CONFLICT:
+            return api_error('Whitelist was changed by someone else', 412, **(e.data or {}))
+        return api_error(f'Service request failed: {e}', 503)
+    response = jsonify(version=version)
+    response.set_etag(version)
+    return response
+
+@app.route('/api/whitelist')
+def api_list_whitelist():
+    """One page of the UIDs starting with `prefix`, in sorted order."""
+    prefix = request.args.get('prefix', '').strip().lower()
+    if prefix.strip(HEX_DIGITS):
+        return api_error('Invalid UID prefix', 400)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), WHITELIST_PAGE_LIMIT)
+    version, uids = uid_index()
+    start, end = search_uids(uids, prefix)
+    page = uids[min(start + offset, end):min(start + offset + limit, end)]
+    response = jsonify(version=version, total=end - start, offset=offset, limit=limit, uids=page)
+    prefix_hash = hashlib.blake2b(prefix.encode()).hexdigest()[:16]
+    return revalidated(response, f'{version}-{prefix_hash}-{offset}-{limit}')
+
+@app.route('/api/whitelist', methods=['POST'])
+def api_add_uid():
+    uid = normalize_uid((request.get_json(silent=True) or {}).get('uid'))
+    if uid is None:
+        return api_error('Invalid UID', 400)
+    return apply_whitelist_change(add=[uid])
+
+@app.route('/api/whitelist/<uid>', methods=['DELETE'])
+def api_remove_uid(uid):
+    uid = normalize_uid(uid)
+    if uid is None:
+        return api_error('Invalid UID', 400)
+    uids = uid_index()[1]
+    start, end = search_uids(uids, uid)
+    if start == end or uids[start] != uid:
+        return api_error('UID not in whitelist', 404)
+    return apply_whitelist_change(remove=[uid])
+
+@app.route('/api/whitelist/import', methods=['POST'])
+def api_import_uids():
+    """Add a list of UIDs, or replace the whole whitelist with it if
+    `replace` is true."""
+    body = request.get_json(silent=True) or {}
+    uids = body.get('uids')
+    if not isinstance(uids, list):
+        return api_error('Expected a list of UIDs', 400)
+    normalized = [normalize_uid(uid) for uid in uids]
+    invalid = [uid for uid, norm in zip(uids, normalized) if norm is None]
+    if invalid:
+        return api_error('Invalid UIDs', 400, invalid=invalid[:20])
+    if body.get('replace'):
+        return apply_whitelist_change(replace=normalized)
+    return apply_whitelist_change(add=normalized)
 
 @app.route('/logs')
 def logs():
     return render_template('logs.html')
 
-def stream_logs():
-    process = subprocess.Popen(['journalctl', '-u', SERVICE_NAME, '-f'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    while True:
-        output = process.stdout.readline()
-        if output:
-            socketio.emit('log_update', {'log': output.decode('utf-8').strip()})
-        else:
-            break
+class JournalSource:
+    """Follows the service journal, starting with the last `backlog` lines."""
+
+    def __init__(self, backlog):
+        self.process = subprocess.Popen(['journalctl', '-u', SERVICE_NAME, '-f', '-n', str(backlog)],
+                                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def __iter__(self):
+        for output in self.process.stdout:
+            yield output.decode('utf-8', 'replace').strip()
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+
+class FakeLogSource:
+    """Generates `rate` made-up log lines per second."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.closed = False
+
+    def __iter__(self):
+        count = 0
+        while not self.closed:
+            count += 1
+            yield f"{datetime.now():%b %d %H:%M:%S} fake {SERVICE_NAME}: line {count}"
+            socketio.sleep(1 / self.rate)
+
+    def close(self):
+        self.closed = True
+
+def open_log_source():
+    if LOG_SOURCE == 'fake':
+        return FakeLogSource(FAKE_LOG_RATE)
+    return JournalSource(LOG_BACKLOG)
+
+class LogTailer:
+    """Tails the service log once for all Socket.IO clients of this worker.
+    The last `backlog` lines are kept in a ring buffer and sent to every new
+    subscriber. New lines are collected and sent to the logs room in one
+    frame every `batch_interval` seconds. The source is closed when the
+    last subscriber leaves."""
+
+    def __init__(self, open_source, backlog=200, batch_interval=0.25):
+        self.open_source = open_source
+        self.backlog = deque(maxlen=backlog)
+        self.batch_interval = batch_interval
+        self.subscribers = set()
+        self._pending = []
+        self._source = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, sid):
+        """Add a client that already joined the logs room and send it the
+        backlog. Starts the source for the first subscriber."""
+        with self._lock:
+            self.subscribers.add(sid)
+            source = None
+            if self._source is None:
+                # The journal replays its own backlog through the room
+                backlog = []
+                self.backlog.clear()
+                self._pending = []
+                source = self._source = self.open_source()
+            else:
+                # Pending lines reach the new client with the next batch
+                backlog = list(self.backlog)[:max(0, len(self.backlog) - len(self._pending))]
+        if source is not None:
+            socketio.start_background_task(self._tail, source)
+            socketio.start_background_task(self._fan_out, source)
+        if backlog:
+            socketio.emit('log_batch', {'logs': backlog}, to=sid)
+
+    def unsubscribe(self, sid):
+        with self._lock:
+            self.subscribers.discard(sid)
+            if self.subscribers or self._source is None:
+                return
+            source, self._source = self._source, None
+            self.backlog.clear()
+            self._pending = []
+        source.close()
+
+    def _tail(self, source):
+        try:
+            for line in source:
+                with self._lock:
+                    if self._source is not source:
+                        break
+                    self.backlog.append(line)
+                    self._pending.append(line)
+        finally:
+            with self._lock:
+                # Let the next subscriber start over if the source died
+                if self._source is source:
+                    self._source = None
+
+    def _fan_out(self, source):
+        while True:
+            socketio.sleep(self.batch_interval)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                running = self._source is source
+            if batch:
+                socketio.emit('log_batch', {'logs': batch}, to=LOG_ROOM)
+            if not running:
+                break
+
+log_tailer = LogTailer(open_log_source, backlog=LOG_BACKLOG)
 
 @socketio.on('connect')
 def handle_connect():
-    thread = threading.Thread(target=stream_logs)
-    thread.start()
+    join_room(LOG_ROOM)
+    log_tailer.subscribe(request.sid)
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    log_tailer.unsubscribe(request.sid)
 
 if __name__ == '__main__':
     socketio.run(app, host='0.0.0.0', port=80)
@@ -0,0 +1,67 @@
+"""
+Client for the control socket of the reader service. Requests are JSON-RPC
+2.0 objects sent one per line over a Unix domain socket, so admin actions
+take effect without restarting the service.
+"""
+
+import asyncio
+import itertools
+import json
+
+# Error code of the service for changes based on an outdated version
+VERSION_CONFLICT = -32001
+# Longest answer line, the same limit as the service has for requests
+MAX_RESPONSE_SIZE = 16 * 1024 * 1024
+
+
+class ControlError(Exception):
+    """The service answered with an error or could not be reached."""
+
+    def __init__(self, message, code=None, data=None):
+        super().__init__(message)
+        self.code = code
+        self.data = data
+
+
+class ControlClient:
+    """Opens a connection per call and waits up to `timeout` seconds for
+    the answer."""
+
+    def __init__(self, path, timeout=2):
+        self.path = path
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+
+    async def call(self, method, **params):
+        """Call method on the service and return its result."""
+        request = {'jsonrpc': '2.0', 'id': next(self._ids), 'method': method, 'params': params}
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(self.path, limit=MAX_RESPONSE_SIZE), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ControlError(f'Service not reachable: {e}')
+        try:
+            writer.write(json.dumps(request).encode() + b'\n')
+            await writer.drain()
+            line = await asyncio.wait_for(reader.readline(), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ControlError(f'No answer from service: {e}')
+        except ValueError as e:
+            # readline raises this for a line longer than the limit
+            raise ControlError(f'Answer from service too long: {e}')
+        finally:
+            writer.close()
+        if not line:
+            raise ControlError('Service closed the connection')
+        try:
+            response = json.loads(line)
+        except ValueError as e:
+            raise ControlError(f'Invalid answer from service: {e}')
+        if 'error' in response:
+            error = response['error']
+            raise ControlError(error['message'], error['code'], error.get('data'))
+        return response['result']
+
+    def call_sync(self, method, **params):
+        """Run call from synchronous code such as a Flask view."""
+        return asyncio.run(self.call(method, **params))
@@ -0,0 +1,272 @@
+"""
+This module holds the whitelist of card UIDs and reloads it whenever
+whitelist.txt changes on disk, so edits from the web UI take effect without
+restarting the service.
+
+Adds and removes are appended to whitelist.txt.journal and folded into
+whitelist.txt from time to time. Only the service writes the files, the web
+UI sends its changes over the control socket. Writes hold an exclusive flock
+on whitelist.txt.lock, readers such as the web UI a shared one, and
+whitelist.txt itself is only ever replaced by rename.
+"""
+
+import asyncio
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+from event_store import DECISION_MASTER, DECISION_WHITELISTED, DECISION_UNKNOWN
+
+
+class VersionConflict(Exception):
+    """The whitelist files are no longer at the version a change expected."""
+
+    def __init__(self, version):
+        super().__init__(version)
+        self.version = version
+
+
+def file_version(signature):
+    """Short opaque version string for a file signature as returned by
+    Whitelist._stat. The web UI derives the same string from the files."""
+    return hashlib.sha1(repr(signature).encode()).hexdigest()[:16]
+
+
+def parse_uid(text):
+    """Turn a hex UID as stored on disk into the bytes key used in memory,
+    or None if it is not valid hex."""
+    try:
+        return bytes.fromhex(text)
+    except ValueError:
+        logging.error(f"Ignoring invalid UID in whitelist: {text!r}")
+        return None
+
+
+class Whitelist:
+    """Set of whitelisted UIDs backed by a text file with one hex UID per
+    line plus a journal of later changes. UIDs are kept as bytes in memory.
+    The files are watched by polling their mtime and size, and a freshly
+    parsed set is swapped in atomically when they change.
+
+    Master card UIDs are merged in as well, so `decide` answers every scan
+    with a single dict lookup."""
+
+    def __init__(self, path, master_uids=(), poll_interval=0.25, compact_threshold=50):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.lock_path = path + '.lock'
+        self.poll_interval = poll_interval
+        self.compact_threshold = compact_threshold
+        self.master_uids = frozenset(master_uids)
+        self.uids = frozenset()
+        self.decisions = {}
+        self.reload_count = 0
+        self.reloaded_at = None
+        self._journal_entries = 0
+        self._signature = None
+        self.load()
+
+    @contextlib.contextmanager
+    def _locked(self, operation=fcntl.LOCK_EX):
+        # Opened read-only so the web UI user can lock a file created by root
+        fd = os.open(self.lock_path, os.O_RDONLY | os.O_CREAT, 0o664)
+        try:
+            fcntl.flock(fd, operation)
+            yield
+        finally:
+            os.close(fd)
+
+    def _stat(self):
+        signature = []
+        for path in (self.path, self.journal_path):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                signature.append(None)
+                continue
+            signature.append((st.st_mtime_ns, st.st_size, st.st_ino))
+        return tuple(signature)
+
+    def _parse(self):
+        uids = set()
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                uids.update(parse_uid(line) for line in (line.strip() for line in f) if line)
+        entries = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r') as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        # Torn last line after a crash, ignore it
+                        break
+                    line = line.strip()
+                    if line[:1] == '+':
+                        uids.add(parse_uid(line[1:]))
+                    elif line[:1] == '-':
+                        uids.discard(parse_uid(line[1:]))
+                    else:
+                        continue
+                    entries += 1
+        uids.discard(None)
+        return frozenset(uids), entries
+
+    def _swap(self, uids):
+        decisions = dict.fromkeys(uids, DECISION_WHITELISTED)
+        decisions.update(dict.fromkeys(self.master_uids, DECISION_MASTER))
+        # Rebind both in one go, readers never see a half-built dict
+        self.uids, self.decisions = uids, decisions
+
+    def set_master_uids(self, master_uids):
+        """Replace the master card UIDs, given as bytes."""
+        self.master_uids = frozenset(master_uids)
+        self._swap(self.uids)
+
+    def decide(self, uid):
+        """Return the decision for a UID given as bytes."""
+        return self.decisions.get(uid, DECISION_UNKNOWN)
+
+    def load(self):
+        """Parse the file and journal and swap in the new set. Returns False
+        if the files changed while they were being read, in which case
+        nothing is swapped."""
+        with self._locked(fcntl.LOCK_SH):
+            signature = self._stat()
+            uids, entries = self._parse()
+        if self._stat() != signature:
+            return False
+        self._swap(uids)
+        self._journal_entries = entries
+        self._signature = signature
+        self.reload_count += 1
+        self.reloaded_at = time.time()
+        return True
+
+    def check(self):
+        """Reload if the file or journal changed since they were last read."""
+        if self._stat() == self._signature:
+            return False
+        if not self.load():
+            return False
+        logging.info(f'Whitelist reloaded with {len(self.uids)} cards '
+                     f'(reload #{self.reload_count}).')
+        return True
+
+    async def watch(self):
+        """Poll the files for changes every `poll_interval` seconds."""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                self.check()
+            except OSError as e:
+                logging.error(f"Failed to reload whitelist: {e}")
+
+    def __contains__(self, uid):
+        return uid in self.uids
+
+    def __len__(self):
+        return len(self.uids)
+
+    def __iter__(self):
+        return iter(self.uids)
+
+    def version(self):
+        """Version of the files on disk, changes with every write by anyone."""
+        return file_version(self._stat())
+
+    def change(self, add=(), remove=(), replace=None, expected_versions=None):
+        """Apply a batch of changes with one locked write and return the new
+        version. add and remove are appended to the journal, replace writes
+        a whitelist file with exactly those UIDs instead. With
+        expected_versions the change is only made if the files are still at
+        one of them, otherwise VersionConflict is raised."""
+        with self._locked():
+            signature = self._stat()
+            if expected_versions is not None and file_version(signature) not in expected_versions:
+                raise VersionConflict(file_version(signature))
+            if replace is not None:
+                uids = frozenset(replace)
+                write_atomic(self.path, ''.join(f"{uid.hex()}\n" for uid in sorted(uids)))
+                if os.path.exists(self.journal_path):
+                    os.unlink(self.journal_path)
+                self._swap(uids)
+                self._journal_entries = 0
+                self._signature = self._stat()
+                return file_version(self._signature)
+            # Only skip the reload of our own write if nobody else wrote since
+            unchanged = signature == self._signature
+            lines = [f"+{uid.hex()}\n" for uid in add] + [f"-{uid.hex()}\n" for uid in remove]
+            # A line torn by a crash would run into the first new entry
+            _drop_torn_line(self.journal_path)
+            with open(self.journal_path, 'a') as f:
+                f.write(''.join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            self._swap((self.uids | frozenset(add)) - frozenset(remove))
+            self._journal_entries += len(lines)
+            if self._journal_entries >= self.compact_threshold:
+                self._compact()
+                unchanged = True
+            signature = self._stat()
+            if unchanged:
+                self._signature = signature
+            return file_version(signature)
+
+    def add(self, uid):
+        """Add a UID by appending it to the journal."""
+        self.change(add=[uid])
+
+    def remove(self, uid):
+        """Remove a UID by appending the removal to the journal."""
+        self.change(remove=[uid])
+
+    def compact(self):
+        """Fold the journal into the whitelist file."""
+        with self._locked():
+            self._compact()
+            self._signature = self._stat()
+
+    def _compact(self):
+        # Caller holds the exclusive lock. Re-read from disk so edits made
+        # to the file by hand are not lost.
+        uids, _ = self._parse()
+        write_atomic(self.path, ''.join(f"{uid.hex()}\n" for uid in sorted(uids)))
+        if os.path.exists(self.journal_path):
+            os.unlink(self.journal_path)
+        self._swap(uids)
+        self._journal_entries = 0
+
+
+def _drop_torn_line(path):
+    """Cut off a last line without a newline. Only called while holding
+    the exclusive lock."""
+    try:
+        with open(path, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            # A journal line is a few dozen bytes, the tail is enough
+            start = f.seek(max(size - 64, 0))
+            tail = f.read()
+            if tail and not tail.endswith(b'\n'):
+                f.truncate(start + tail.rfind(b'\n') + 1)
+    except FileNotFoundError:
+        pass
+
+
+def write_atomic(path, content):
+    """Write content to a temporary file next to path and rename it over
+    path, so readers see either the old or the new file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.whitelist.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o664)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise